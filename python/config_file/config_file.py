@@ -1,9 +1,80 @@
+import ctypes
+import ctypes.util
+import hashlib
+import io
+import logging
+import marshal
+import mmap
+import os
+import re
+import select
+import struct
+import sys
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
 __version__ = '1.0'
 
+logger = logging.getLogger(__name__)
+
+
+def parse_bool(value):
+    value = value.lower()
+    if value in ('1', 'true', 'yes', 'on'):
+        return True
+    if value in ('0', 'false', 'no', 'off', ''):
+        return False
+    raise ValueError(f'Not a boolean: {value!r}')
+
+
+DURATION_RE = re.compile(r'(\d+(?:\.\d+)?)\s*(ms|s|m|h|d|w)?', re.IGNORECASE)
+DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+
+def parse_duration(value):
+    '''
+    Converts a duration like '90', '1.5s', '500ms' or '1h 30m' to seconds.
+    Numbers without a unit are seconds.
+    '''
+    seconds, position = 0.0, 0
+    for match in DURATION_RE.finditer(value):
+        if value[position:match.start()].strip():
+            break
+        seconds += float(match.group(1)) * DURATION_UNITS[(match.group(2) or 's').lower()]
+        position = match.end()
+
+    if not position or value[position:].strip():
+        raise ValueError(f'Not a duration: {value!r}')
+
+    return seconds
+
+
+def parse_list(value, separator=','):
+    # A tuple, as the memoised value is shared by all the callers
+    return tuple(item.strip() for item in value.split(separator) if item.strip())
+
 
 class ConfigLineParser:
-    def __init__(self, line=None):
+    '''
+    Typed values are converted on first access and memoised until the key is parsed again,
+    in a flat `{(key, kind): value}` dict, so a memoised lookup is a single `dict.get`.
+    Keys listed in `schema` (e.g. `{'port': 'int', 'timeout': 'duration'}`) are converted
+    as soon as they are parsed, so invalid values are reported at load time.
+    '''
+    CONVERTERS = {
+        'str': str,
+        'int': int,
+        'float': float,
+        'bool': parse_bool,
+        'duration': parse_duration,
+        'list': parse_list,
+    }
+
+    def __init__(self, line=None, schema=None):
         self._config = {}
+        self._typed = {}
+        self._schema = dict(schema or {})
 
         if line:
             self.parse_line(line)
@@ -22,6 +93,12 @@ class ConfigLineParser:
         key, value = key.strip().lower(), value.strip()
 
         self._config[key] = value
+        if self._typed:
+            for memo_key in [memo_key for memo_key in self._typed if memo_key[0] == key]:
+                del self._typed[memo_key]
+
+        if key in self._schema:
+            self.get(key)
 
         return self.get_config()
 
@@ -31,18 +108,385 @@ class ConfigLineParser:
     def get_value(self, key):
         return self._config.get(key, None)
 
+    def _get_typed(self, key, kind, default=None, *args):
+        ''' Converts the value and memoises it. The accessors check the memo themselves before calling it '''
+        value = self.get_value(key)
+        if value is None:
+            return default
+
+        converter = self.CONVERTERS[kind] if isinstance(kind, str) else kind
+        try:
+            converted = converter(value, *args)
+        except ValueError as e:
+            raise ValueError(f"Invalid value of '{key}': {e}") from None
+
+        self._typed[(key, kind, *args)] = converted
+
+        return converted
+
+    def _convert_schema(self):
+        ''' Converts all the values listed in the schema, after the config has been replaced as a whole '''
+        self._typed = {}
+        for key in self._schema:
+            self.get(key)
+
+    def get(self, key, default=None):
+        ''' Returns the value converted to the type from the schema (`str` if the key is not in the schema) '''
+        kind = self._schema.get(key, 'str')
+        value = self._typed.get((key, kind))
+        return self._get_typed(key, kind, default) if value is None else value
+
+    def get_int(self, key, default=None):
+        value = self._typed.get((key, 'int'))
+        return self._get_typed(key, 'int', default) if value is None else value
+
+    def get_float(self, key, default=None):
+        value = self._typed.get((key, 'float'))
+        return self._get_typed(key, 'float', default) if value is None else value
+
+    def get_bool(self, key, default=None):
+        value = self._typed.get((key, 'bool'))
+        return self._get_typed(key, 'bool', default) if value is None else value
+
+    def get_duration(self, key, default=None):
+        ''' Returns the duration in seconds '''
+        value = self._typed.get((key, 'duration'))
+        return self._get_typed(key, 'duration', default) if value is None else value
+
+    def get_list(self, key, default=None, separator=','):
+        ''' Returns a tuple of the non-empty items '''
+        value = self._typed.get((key, 'list', separator))
+        return self._get_typed(key, 'list', default, separator) if value is None else value
+
+
+class ConfigCache:
+    '''
+    Process-wide cache of parsed config files.
+
+    Entries are checked against the file's (mtime, size, inode), so unchanged files
+    are never reread, and changed ones are reparsed on the next access.
+    Subscribers are notified whenever a file is reparsed with a different config.
+    '''
+    def __init__(self):
+        self._entries = {}
+        self._subscribers = {}
+        self._lock = threading.RLock()
+        self._watcher = None
+
+    @staticmethod
+    def _stat_key(file):
+        stat = os.stat(file)
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    @staticmethod
+    def _read_file(file):
+        '''
+        Returns the stat key of the file and its content, read from the same descriptor,
+        so the key describes exactly the bytes that were read.
+        '''
+        with open(file, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            return (stat.st_mtime_ns, stat.st_size, stat.st_ino), f.read()
+
+    @staticmethod
+    def _parse_data(data):
+        parser = ConfigLineParser()
+        # Decoded the same way as a file opened in text mode
+        for line in io.TextIOWrapper(io.BytesIO(data)):
+            parser.parse_line(line)
+        return parser.get_config()
+
+    def get(self, file, snapshot=False):
+        file = os.path.abspath(file)
+        stat_key = self._stat_key(file)
+
+        with self._lock:
+            # Entries are (stat key, config, digest of the parsed bytes, whether the snapshot is saved)
+            entry = self._entries.get(file)
+            if entry and entry[0] == stat_key:
+                if snapshot and not entry[3]:
+                    ConfigSnapshot.save(file, entry[1], entry[0], entry[2])
+                    self._entries[file] = entry[:3] + (True,)
+                return entry[1]
+
+            loaded = ConfigSnapshot.load(file) if snapshot else None
+            if loaded:
+                stat_key, digest, config = loaded
+            else:
+                stat_key, data = self._read_file(file)
+                digest = hashlib.sha1(data).hexdigest()
+                config = self._parse_data(data)
+                if snapshot:
+                    ConfigSnapshot.save(file, config, stat_key, digest)
+
+            self._entries[file] = stat_key, config, digest, snapshot
+
+        if entry and entry[1] != config:
+            self._notify(file, config)
+
+        return config
+
+    def refresh(self, file):
+        try:
+            return self.get(file)
+        except OSError:
+            self.invalidate(file)
+
+    def invalidate(self, file=None):
+        with self._lock:
+            if file is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(os.path.abspath(file), None)
+
+    def subscribe(self, file, callback):
+        '''
+        Calls `callback(file, config)` when the file is reparsed with a different config.
+        Bound methods are kept as weak references.
+        '''
+        file = os.path.abspath(file)
+        ref = weakref.WeakMethod(callback) if hasattr(callback, '__self__') else (lambda: callback)
+
+        with self._lock:
+            self._subscribers.setdefault(file, []).append(ref)
+
+    def _notify(self, file, config):
+        with self._lock:
+            refs = self._subscribers.get(file, [])
+            refs[:] = [ref for ref in refs if ref() is not None]
+            callbacks = [ref() for ref in refs]
+
+        # A failing subscriber mustn't stop the others (or the watcher thread calling them)
+        for callback in callbacks:
+            if callback is not None:
+                try:
+                    callback(file, config)
+                except Exception:
+                    logger.exception('Config subscriber %r failed on %s', callback, file)
+
+    def watch(self, file, interval=1.0):
+        '''
+        Watches the file in a background thread (inotify on Linux, stat polling elsewhere)
+        and reparses it as soon as it changes, so subscribers get updates without any access.
+        '''
+        with self._lock:
+            if self._watcher is None:
+                self._watcher = ConfigWatcher(self, interval=interval)
+                self._watcher.start()
+
+        self._watcher.add(os.path.abspath(file))
+        self.get(file)
+
+    def stop_watching(self):
+        with self._lock:
+            watcher, self._watcher = self._watcher, None
+
+        if watcher:
+            watcher.stop()
+
+
+class ConfigWatcher(threading.Thread):
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_TO = 0x080
+    IN_DELETE = 0x200
+    EVENT = struct.Struct('iIII')
+
+    def __init__(self, cache, interval=1.0):
+        super(ConfigWatcher, self).__init__(name='ConfigWatcher', daemon=True)
+
+        self._cache = cache
+        self._interval = interval
+        self._files = set()
+        self._watches = {}
+        self._stopped = threading.Event()
+        self._inotify = self._init_inotify()
+
+    @staticmethod
+    def _init_inotify():
+        if not sys.platform.startswith('linux'):
+            return None
+
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+
+        return (libc, fd) if fd >= 0 else None
+
+    def add(self, file):
+        self._files.add(file)
+
+        if self._inotify:
+            libc, fd = self._inotify
+            # Directories are watched, as editors often replace files instead of writing them.
+            # Only complete writes are reported: a file being written would be parsed half-written
+            directory = os.path.dirname(file)
+            mask = self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_DELETE
+            wd = libc.inotify_add_watch(fd, os.fsencode(directory), mask)
+            if wd >= 0:
+                self._watches[wd] = directory
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                if self._inotify:
+                    self._read_events()
+                else:
+                    self._stopped.wait(self._interval)
+                    for file in list(self._files):
+                        self._refresh(file)
+            except Exception:
+                # Keep watching the other files
+                logger.exception('Config watcher failed')
+
+    def _read_events(self):
+        fd = self._inotify[1]
+        readable, _, _ = select.select([fd], [], [], self._interval)
+        if not readable:
+            return
+
+        try:
+            data = os.read(fd, 64 * 1024)
+        except BlockingIOError:
+            return
+
+        changed = set()
+        offset = 0
+        while offset < len(data):
+            wd, _, _, length = self.EVENT.unpack_from(data, offset)
+            offset += self.EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+
+            file = os.path.join(self._watches.get(wd, ''), name)
+            if file in self._files:
+                changed.add(file)
+
+        for file in changed:
+            self._refresh(file)
+
+    def _refresh(self, file):
+        try:
+            self._cache.refresh(file)
+        except Exception:
+            logger.exception('Cannot reload config %s', file)
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+        if self._inotify:
+            os.close(self._inotify[1])
+
+
+class ConfigSnapshot:
+    '''
+    Compiled config stored next to the source file as a marshal blob,
+    so it can be loaded by the next processes without parsing the text.
+
+    A snapshot is valid while the source's (mtime, size) are the same. If they differ,
+    the source's hash is checked, so touched but unchanged files don't need reparsing.
+    '''
+    VERSION = 1
+
+    @staticmethod
+    def path(file):
+        return file + '.snapshot'
+
+    @staticmethod
+    def load(file):
+        '''
+        Returns `(stat_key, digest, config)` of a valid snapshot of the file, or None.
+        '''
+        try:
+            with open(ConfigSnapshot.path(file), 'rb') as f:
+                version, saved_stat, digest, config = marshal.loads(f.read())
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+
+        if version != ConfigSnapshot.VERSION:
+            return None
+
+        stat_key = ConfigCache._stat_key(file)
+        if tuple(saved_stat) != stat_key[:2]:
+            stat_key, data = ConfigCache._read_file(file)
+            if digest != hashlib.sha1(data).hexdigest():
+                return None
+            ConfigSnapshot.save(file, config, stat_key, digest)
+
+        return stat_key, digest, config
+
+    @staticmethod
+    def save(file, config, stat_key, digest):
+        '''
+        :param stat_key: stat key of the source the config was parsed from
+        :param digest: SHA-1 of the exact bytes the config was parsed from
+        '''
+        data = marshal.dumps((ConfigSnapshot.VERSION, stat_key[:2], digest, config))
+
+        path = ConfigSnapshot.path(file)
+        try:
+            with open(path + '.tmp', 'wb') as f:
+                f.write(data)
+            os.replace(path + '.tmp', path)
+        except OSError:
+            # Snapshots are optional: e.g. the directory may be read-only
+            pass
+
+
+CONFIG_CACHE = ConfigCache()
+
 
 class ConfigFileParser(ConfigLineParser):
-    def __init__(self, file, *args, **kwargs):
+    def __init__(self, file, *args, use_cache=True, snapshot=False, **kwargs):
         super(ConfigFileParser, self).__init__(*args, **kwargs)
 
         self._file = file
-        self._parse(self._file)
+        self._use_cache = use_cache
+        self._snapshot = snapshot
+        self._replace(self._parse(self._file, self._config))
+
+    def _parse(self, file, config):
+        ''' Returns a new dict with the config of the file on top of `config` '''
+        config = dict(config)
+        if self._use_cache:
+            config.update(CONFIG_CACHE.get(file, snapshot=self._snapshot))
+            return config
 
-    def _parse(self, file):
+        parser = ConfigLineParser()
         with open(file) as f:
-            for line in f.readlines():
-                self.parse_line(line)
+            for line in f:
+                parser.parse_line(line)
+        config.update(parser.get_config())
+
+        return config
+
+    def _replace(self, config):
+        '''
+        Replaces the config as a whole. The dict is swapped instead of being updated in place,
+        so readers in other threads get either the old config or the new one.
+        '''
+        self._config = config
+        self._convert_schema()
+
+    def reload(self):
+        self._replace(self._parse(self._file, {}))
+
+        return self
+
+    def watch(self):
+        '''
+        Keeps the config up to date with the file: it's updated in the background
+        as soon as the file changes.
+        '''
+        CONFIG_CACHE.subscribe(self._file, self._on_change)
+        CONFIG_CACHE.watch(self._file)
+
+        return self
+
+    def _on_change(self, file, config):
+        self._replace(dict(config))
 
     def __enter__(self):
         return self
@@ -54,6 +498,278 @@ class ConfigFileParser(ConfigLineParser):
         return f'{self.__class__.__name__}({str(self.get_config())})'
 
 
+class MappedConfigFileParser(ConfigFileParser):
+    '''
+    Parser for very large config files.
+
+    The file is memory-mapped and scanned with a single regex, without building a list of lines.
+    The index keeps only the keys and the offsets of their values, which are decoded on first `get_value`.
+
+    The file is stat'ed on every lookup (values decoded before included) and reloaded if it has changed,
+    so lookups never mix two versions of the file, and a map of a file truncated in place
+    (which would kill the process with SIGBUS) is never read. Typed values aren't memoised for the same reason.
+    '''
+    KEY_RE = re.compile(rb'^([^#=\n]*)=', re.MULTILINE)
+
+    def __init__(self, file, *args, **kwargs):
+        self._index = {}
+        self._map = None
+        self._stat = None
+        self._watcher = None
+        self._lock = threading.RLock()
+
+        super(MappedConfigFileParser, self).__init__(file, *args, **kwargs)
+
+    def _parse(self, file, config):
+        self._index = {}
+
+        with open(file, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            self._stat = stat.st_mtime_ns, stat.st_size, stat.st_ino
+            if stat.st_size == 0:
+                return dict(config)
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        index = self._index
+        for match in self.KEY_RE.finditer(self._map):
+            key = match.group(1).strip()
+            # Keys are kept as bytes: only non-ASCII ones need decoding to be lowercased the same way as `str`
+            key = key.lower() if key.isascii() else key.decode().strip().lower().encode()
+            index[key] = match.end()
+
+        # Keys from the file override the ones parsed from lines before. Their values are decoded on access
+        return {key: value for key, value in config.items() if key.encode() not in index}
+
+    def _check_file(self):
+        ''' Reloads the file if it has changed since it was mapped '''
+        try:
+            stat_key = ConfigCache._stat_key(self._file)
+        except OSError:
+            stat_key = None
+
+        if stat_key != self._stat:
+            self.reload()
+
+    def _decode(self, key):
+        start = self._index.get(key.encode())
+        if start is None:
+            return None
+
+        end = self._map.find(b'\n', start)
+        end = len(self._map) if end < 0 else end
+        comment = self._map.find(b'#', start, end)
+        end = end if comment < 0 else comment
+
+        value = self._config[key] = self._map[start:end].decode().strip()
+
+        return value
+
+    def get_value(self, key):
+        with self._lock:
+            self._check_file()
+            value = self._config.get(key)
+            if value is None and key.encode() in self._index:
+                value = self._decode(key)
+
+        return value
+
+    def _get_typed(self, key, kind, default=None, *args):
+        with self._lock:
+            value = super(MappedConfigFileParser, self)._get_typed(key, kind, default, *args)
+            # Not memoised, so the next lookup goes through `get_value` and checks the file again
+            self._typed.clear()
+
+        return value
+
+    def get_config(self):
+        with self._lock:
+            self._check_file()
+            for key in self._index:
+                if key.decode() not in self._config:
+                    self._decode(key.decode())
+
+        return self._config
+
+    def reload(self):
+        with self._lock:
+            self.close_map()
+            self._replace(self._parse(self._file, {}))
+
+        return self
+
+    def watch(self):
+        '''
+        Reloads the file in the background as soon as it changes.
+        The file isn't parsed into CONFIG_CACHE, as it would defeat the purpose of mapping it.
+        '''
+        with self._lock:
+            if self._watcher is None:
+                self._watcher = ConfigWatcher(self)
+                self._watcher.start()
+                self._watcher.add(os.path.abspath(self._file))
+
+        return self
+
+    def refresh(self, file):
+        # Called by the watcher
+        with self._lock:
+            self._check_file()
+
+    def close_map(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def close(self):
+        watcher, self._watcher = self._watcher, None
+        if watcher:
+            watcher.stop()
+
+        self.close_map()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class LayeredConfig:
+    '''
+    Several config files layered on top of each other (e.g. defaults -> site -> host),
+    optionally topped with environment variables starting with `env_prefix`.
+
+    Layers are merged into a single precomputed dict, so `get_value` is a single lookup
+    whatever the number of layers is. Missing files are treated as empty layers.
+    '''
+    ENV = 'env'
+
+    def __init__(self, *files, env_prefix=None):
+        self._files = [os.path.abspath(file) for file in files]
+        self._env_prefix = env_prefix
+        self._config = {}
+        self._provenance = {}
+
+        with ThreadPoolExecutor(max_workers=max(len(self._files), 1)) as executor:
+            self._layers = list(executor.map(self._load, self._files))
+        self._sources = list(self._files)
+
+        if env_prefix is not None:
+            self._layers.append(self._load_env())
+            self._sources.append(self.ENV)
+
+        self._merge(set().union(*self._layers))
+
+    @staticmethod
+    def _load(file):
+        try:
+            return CONFIG_CACHE.get(file)
+        except FileNotFoundError:
+            return {}
+
+    def _load_env(self):
+        prefix = self._env_prefix
+        return {name[len(prefix):].lower(): value for name, value in os.environ.items() if name.startswith(prefix)}
+
+    def _merge(self, keys):
+        # The topmost layer defining a key wins
+        for key in keys:
+            for layer, source in zip(reversed(self._layers), reversed(self._sources)):
+                if key in layer:
+                    self._config[key] = layer[key]
+                    self._provenance[key] = source
+                    break
+            else:
+                self._config.pop(key, None)
+                self._provenance.pop(key, None)
+
+    def _update_layer(self, position, layer):
+        old_layer, self._layers[position] = self._layers[position], layer
+        if layer is not old_layer:
+            self._merge(old_layer.keys() | layer.keys())
+
+    def get_value(self, key):
+        return self._config.get(key, None)
+
+    def get_config(self):
+        return self._config
+
+    def get_source(self, key):
+        ''' Returns the file (or 'env') the value of the key comes from '''
+        return self._provenance.get(key, None)
+
+    def refresh(self):
+        ''' Rereads changed files (and environment variables), remerging only the keys of the changed layers '''
+        for position, file in enumerate(self._files):
+            self._update_layer(position, self._load(file))
+
+        if self._env_prefix is not None:
+            env = self._load_env()
+            if env != self._layers[-1]:
+                self._update_layer(len(self._layers) - 1, env)
+
+        return self
+
+    def watch(self):
+        ''' Keeps the merged config up to date with the files in the background '''
+        for file in self._files:
+            CONFIG_CACHE.subscribe(file, self._on_change)
+            if os.path.exists(file):
+                CONFIG_CACHE.watch(file)
+
+        return self
+
+    def _on_change(self, file, config):
+        self._update_layer(self._files.index(file), config)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({str(self.get_config())})'
+
+
+def benchmark_startup(file, number=100):
+    '''
+    Compares the cold start time of parsing the text config with loading its snapshot.
+    The process-wide cache is cleared before every load to mimic a fresh process.
+    '''
+    import timeit
+
+    def load(snapshot):
+        CONFIG_CACHE.invalidate()
+        return ConfigFileParser(file, snapshot=snapshot)
+
+    load(snapshot=True)
+    results = {}
+    for snapshot in (False, True):
+        results['snapshot' if snapshot else 'text'] = timeit.timeit(lambda: load(snapshot), number=number) / number
+
+    print(f"Text: {results['text'] * 1000:.3f} ms, snapshot: {results['snapshot'] * 1000:.3f} ms "
+          f"(x{results['text'] / results['snapshot']:.1f})")
+
+    return results
+
+
+def benchmark_lookups(file, key, kind='int', number=100000):
+    '''
+    Compares the per-lookup cost of converting the raw value on every call with the memoised typed accessor.
+    '''
+    import timeit
+
+    config = ConfigFileParser(file)
+    convert, accessor = ConfigLineParser.CONVERTERS[kind], getattr(config, f'get_{kind}')
+    results = {
+        'raw': timeit.timeit(lambda: convert(config.get_value(key)), number=number) / number,
+        'typed': timeit.timeit(lambda: accessor(key), number=number) / number,
+    }
+
+    print(f"{kind}(get_value): {results['raw'] * 1e9:.0f} ns, get_{kind}: {results['typed'] * 1e9:.0f} ns "
+          f"(x{results['raw'] / results['typed']:.1f})")
+
+    return results
+
+
 def main():
     import sys
     file = 'config.conf' if len(sys.argv) == 1 else sys.argv[1]
@@ -67,7 +783,20 @@ def main():
     line_config_parser.parse_line('VAR2')
     assert not line_config_parser.get_value('var2')
 
+    assert line_config_parser.get_int('var1') == 12345
+    line_config_parser.parse_line('VAR1 = 54321')
+    assert line_config_parser.get_int('var1') == 54321
+
+    line_config_parser = ConfigLineParser('TIMEOUT = 1m 30s', schema={'timeout': 'duration'})
+    assert line_config_parser.get('timeout') == line_config_parser.get_duration('timeout') == 90
+
     try:
+        with MappedConfigFileParser(file) as mapped_config:
+            assert mapped_config.get_config() == ConfigFileParser(file, use_cache=False).get_config()
+
+        with LayeredConfig(file, env_prefix='CONFIG_') as layered_config:
+            assert layered_config.get_source('city') in (os.path.abspath(file), LayeredConfig.ENV)
+
         with ConfigFileParser(file) as config:
             print(config)
             print(config.get_config())
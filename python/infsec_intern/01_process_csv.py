@@ -1,8 +1,30 @@
+import cProfile
 import csv
+import functools
+import hashlib
+import io
+import itertools
+import json
 import os
+import platform
+import pstats
 import re
 import random
+import shutil
 import string
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa = None
+
+from pipeline import CsvSource, Pipeline, detect_format, make_sink
 
 '''
 Vacancy: https://yandex.ru/jobs/vacancies/interns/infsec_intern/
@@ -19,34 +41,795 @@ Vacancy: https://yandex.ru/jobs/vacancies/interns/infsec_intern/
 '''
 
 
+class Rule:
+    ''' Base class for the validation rules.
+
+    Rules are compiled once and can be combined with `&` (AND) and `|` (OR).
+    '''
+    def __call__(self, value):
+        raise NotImplementedError
+
+    def signature(self):
+        ''' Returns a string which identifies the rule along with its parameters:
+        rules with the same signature give the same verdicts.
+        Rules with parameters of their own should extend it.
+        '''
+        return type(self).__name__
+
+    def validate_many(self, values):
+        ''' Validates a batch of values at once.
+
+        :param values: list of values to validate
+        '''
+        return [self(value) for value in values]
+
+    def validate_array(self, array):
+        ''' Validates a pyarrow string array and returns a boolean mask.
+        Rules without a vectorized kernel fall back to `validate_many`.
+
+        :param array: pyarrow.Array of strings
+        '''
+        return pa.array(self.validate_many(array.to_pylist()), type=pa.bool_())
+
+    def __and__(self, other):
+        return AllOf(self, other)
+
+    def __or__(self, other):
+        return AnyOf(self, other)
+
+
+class AllOf(Rule):
+    def __init__(self, *rules):
+        self.rules = rules
+
+    def __call__(self, value):
+        return all(rule(value) for rule in self.rules)
+
+    def signature(self):
+        return f'{type(self).__name__}({", ".join(rule.signature() for rule in self.rules)})'
+
+    def validate_many(self, values):
+        verdicts = list(self.rules[0].validate_many(values))
+        for rule in self.rules[1:]:
+            # The next rules validate only the values which are still valid
+            indexes = [i for i, verdict in enumerate(verdicts) if verdict]
+            if not indexes:
+                break
+            for i, verdict in zip(indexes, rule.validate_many([values[i] for i in indexes])):
+                verdicts[i] = verdict
+        return verdicts
+
+    def validate_array(self, array):
+        mask = self.rules[0].validate_array(array)
+        for rule in self.rules[1:]:
+            mask = pc.and_(mask, rule.validate_array(array))
+        return mask
+
+
+class AnyOf(Rule):
+    def __init__(self, *rules):
+        self.rules = rules
+
+    def __call__(self, value):
+        return any(rule(value) for rule in self.rules)
+
+    def signature(self):
+        return f'{type(self).__name__}({", ".join(rule.signature() for rule in self.rules)})'
+
+    def validate_many(self, values):
+        verdicts = list(self.rules[0].validate_many(values))
+        for rule in self.rules[1:]:
+            # The next rules validate only the values which are still invalid
+            indexes = [i for i, verdict in enumerate(verdicts) if not verdict]
+            if not indexes:
+                break
+            for i, verdict in zip(indexes, rule.validate_many([values[i] for i in indexes])):
+                verdicts[i] = verdict
+        return verdicts
+
+    def validate_array(self, array):
+        mask = self.rules[0].validate_array(array)
+        for rule in self.rules[1:]:
+            mask = pc.or_(mask, rule.validate_array(array))
+        return mask
+
+
+class RegexRule(Rule):
+    def __init__(self, pattern):
+        self.pattern = re.compile(pattern)
+
+    def __call__(self, value):
+        return self.pattern.fullmatch(value) is not None
+
+    def signature(self):
+        return f'{type(self).__name__}({self.pattern.pattern!r}, flags={self.pattern.flags})'
+
+    def validate_many(self, values):
+        fullmatch = self.pattern.fullmatch
+        return [fullmatch(value) is not None for value in values]
+
+    def validate_array(self, array):
+        # Arrow uses RE2 syntax which covers the usual patterns
+        return pc.match_substring_regex(array, f'^(?:{self.pattern.pattern})$')
+
+
+class LengthRule(Rule):
+    def __init__(self, min_length=0, max_length=None):
+        self.min_length = min_length
+        self.max_length = max_length
+
+    def __call__(self, value):
+        return self.min_length <= len(value) and (self.max_length is None or len(value) <= self.max_length)
+
+    def signature(self):
+        return f'{type(self).__name__}({self.min_length}, {self.max_length})'
+
+
+class CharsetRule(Rule):
+    def __init__(self, charset):
+        self.charset = ''.join(sorted(set(charset)))
+
+    def __call__(self, value):
+        # `strip` removes the allowed chars from both ends, so only an empty string is left
+        # if the value consists of the allowed chars only
+        return not value.strip(self.charset)
+
+    def signature(self):
+        return f'{type(self).__name__}({self.charset!r})'
+
+
+class LoginRule(Rule):
+    ''' Checks `^[a-zA-Z][a-zA-Z0-9-]{1,13}[a-zA-Z0-9]$` without regex.
+    Unlike `re.match` with that pattern, where `$` also matches before a trailing newline,
+    a value ending with a newline is rejected.
+    '''
+    LETTERS = string.ascii_letters
+    CHARS = string.ascii_letters + string.digits + '-'
+    PATTERN = '^[a-zA-Z][a-zA-Z0-9-]{1,13}[a-zA-Z0-9]$'
+
+    def __call__(self, value):
+        return (3 <= len(value) <= 15 and value[0] in self.LETTERS and value[-1] != '-'
+                and not value.strip(self.CHARS))
+
+    def validate_many(self, values):
+        letters, chars = self.LETTERS, self.CHARS
+        return [3 <= len(value) <= 15 and value[0] in letters and value[-1] != '-' and not value.strip(chars)
+                for value in values]
+
+    def validate_array(self, array):
+        return pc.match_substring_regex(array, self.PATTERN)
+
+
+class IPv4Rule(Rule):
+    def __call__(self, value):
+        octets = value.split('.')
+        return len(octets) == 4 and all(
+            octet.isdigit() and octet.isascii() and len(octet) <= 3 and int(octet) <= 255 for octet in octets
+        )
+
+
+class CachedRule(Rule):
+    ''' Memoizes the verdicts of another rule in a bounded LRU cache.
+
+    Valid values are also collected into the `known_valid` set (up to `maxsize` values),
+    which can be saved to a file and loaded by the next runs, so they are not validated at all.
+    '''
+    def __init__(self, rule, maxsize=100_000):
+        self.rule = rule
+        self.maxsize = maxsize
+        self.known_valid = set()
+        self.known_hits = 0
+        self._inherited_valid = frozenset()
+        self._init_cache()
+
+    def _init_cache(self):
+        self._cached = functools.lru_cache(maxsize=self.maxsize)(self.rule.__call__)
+        self._base_info = self._cached.cache_info()
+
+    def __getstate__(self):
+        # lru_cache wrappers can't be pickled, so workers start with an empty cache
+        state = self.__dict__.copy()
+        del state['_cached'], state['_base_info'], state['_inherited_valid']
+        state['known_hits'] = 0
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # Remembered to tell the values found by the worker from the ones it was sent with
+        self._inherited_valid = frozenset(self.known_valid)
+        self._init_cache()
+
+    def __call__(self, value):
+        return self.validate_many([value])[0]
+
+    def signature(self):
+        # The cache doesn't change the verdicts
+        return self.rule.signature()
+
+    def validate_many(self, values):
+        known_valid, cached = self.known_valid, self._cached
+        before = cached.cache_info()
+
+        verdicts = [True if value in known_valid else cached(value) for value in values]
+
+        after = cached.cache_info()
+        self.known_hits += len(values) - (after.hits - before.hits) - (after.misses - before.misses)
+
+        if len(known_valid) < self.maxsize:
+            self.add_valid(itertools.compress(values, verdicts))
+
+        return verdicts
+
+    def validate_array(self, array):
+        return self.rule.validate_array(array)
+
+    def add_valid(self, values):
+        ''' Adds values known to be valid, as long as there are less than `maxsize` of them.
+
+        :param values: iterable of valid values
+        '''
+        room = self.maxsize - len(self.known_valid)
+        if room > 0:
+            self.known_valid.update(itertools.islice(values, room))
+
+    def new_valid(self):
+        ''' Returns the valid values found since the rule was sent to a worker process '''
+        return self.known_valid - self._inherited_valid
+
+    def cache_info(self):
+        info = self._cached.cache_info()
+        return {'hits': self.known_hits + info.hits - self._base_info.hits, 'misses': info.misses - self._base_info.misses}
+
+    def reset_stats(self):
+        ''' Resets the hit and miss counters, keeping the cached verdicts '''
+        self.known_hits = 0
+        self._base_info = self._cached.cache_info()
+
+    def load(self, path):
+        ''' Loads the values known to be valid, saved by the previous runs.
+        The file is ignored if it was saved for another rule.
+
+        :param path: path to the file
+        '''
+        try:
+            with open(path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        if saved.get('rule') == self.signature():
+            self.add_valid(saved['valid'])
+
+    def save(self, path):
+        tmp_file = path + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump({'rule': self.signature(), 'valid': sorted(self.known_valid)}, f)
+        os.replace(tmp_file, path)
+
+
+VALIDATORS = {
+    'login': LoginRule(),
+    'ipv4': IPv4Rule(),
+}
+
+
+def register_validator(name, rule):
+    ''' Registers a validation rule so it can be referenced by name in `ProcessCSV(filter_by_column=...)`
+
+    :param name: name of the rule
+    :param rule: instance of `Rule`
+    '''
+    VALIDATORS[name] = rule
+
+
+def get_validator(rule):
+    ''' Returns a registered rule by its name. Rule instances are returned as is.
+
+    :param rule: name of the registered rule or instance of `Rule`
+    '''
+    if isinstance(rule, Rule):
+        return rule
+
+    try:
+        return VALIDATORS[rule]
+    except KeyError:
+        raise ValueError(f'Unknown validator: {rule!r}') from None
+
+
 class ProcessCSV:
-    def __init__(self, in_csv, out_csv, columns=None, filter_by_column=None):
+    def __init__(self, in_csv, out_csv, columns=None, filter_by_column=None, chunk_size=10_000,
+                 workers=1, encoding='utf-8', engine='python', incremental=False,
+                 profile=None, cache_size=None, cache_file=None, output_format=None):
         self.in_csv = in_csv
         self.out_csv = out_csv
         self.columns = columns or (1, 4)
         self.filter_by_column = filter_by_column or 1
+        self.validators = self._init_validators(self.filter_by_column)
+        self.cache_file = cache_file
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.encoding = encoding
+        self.engine = engine
+        self.incremental = incremental
+        self.checkpoint_file = out_csv + '.checkpoint'
+        self.profile = profile
+        self.output_format = output_format or detect_format(out_csv)
+
+        # Verdicts cache for repetitive columns
+        if cache_size:
+            self.validators = {column: CachedRule(rule, cache_size) for column, rule in self.validators.items()}
+            if self.cache_file:
+                for column, rule in self.validators.items():
+                    rule.load(self._column_cache_file(column))
+        self._worker_cache_info = {'hits': 0, 'misses': 0}
+
+        self.rows_read = 0
+        self.rows_kept = 0
+        self.rows_rejected = 0
+        self.timings = {}
 
         if not os.path.exists(self.in_csv):
             print('No dataset found. Generating new random data to work with...')
             ProcessCSV.generate_random_data(self.in_csv, num=2_000)
 
     def run(self):
-        with open(self.in_csv, 'r') as csv_file:
-            reader = csv.reader(csv_file)
+        ''' Streams the input CSV through the filter in chunks of `chunk_size` rows,
+        so memory usage doesn't depend on the size of the input file.
+        With `workers` > 1 the input is split into byte ranges processed in parallel.
+        With `engine='arrow'` the columnar engine is used instead (requires pyarrow).
+        With `incremental=True` only the rows appended since the previous run are processed
+        (sequentially, so it can't be combined with `workers` > 1 or `engine='arrow'`).
+        With `profile='cpu'` or `profile='memory'` cProfile or tracemalloc reports are printed after the run.
+
+        The output is plain CSV unless `output_format` is set (or detected by the `out_csv` extension):
+        'csv.gz', 'csv.zst', 'parquet' or 'arrow'. Parallel and incremental runs write plain CSV only.
+
+        See `to_pipeline` for the same filter as a generic `Pipeline`.
+        '''
+        if self.output_format != 'csv' and (self.incremental or (self.workers > 1 and self.engine != 'arrow')):
+            raise ValueError(f'{self.output_format!r} output is supported by the sequential and arrow engines only')
+        if self.incremental and (self.workers > 1 or self.engine != 'python'):
+            raise ValueError('Incremental runs are supported by the sequential engine only: '
+                             'use workers=1 and engine=\'python\'')
+
+        self.rows_read = self.rows_kept = self.rows_rejected = 0
+        self.timings = {}
+        self._worker_cache_info = {'hits': 0, 'misses': 0}
+        for _, rule in self._cached_validators():
+            rule.reset_stats()
+
+        if self.profile == 'cpu':
+            profiler = cProfile.Profile()
+            profiler.runcall(self._run_engine)
+            pstats.Stats(profiler).sort_stats('cumulative').print_stats(20)
+        elif self.profile == 'memory':
+            tracemalloc.start()
+            try:
+                self._run_engine()
+                snapshot = tracemalloc.take_snapshot()
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+
+            print(f'Peak traced memory: {peak / 1024:,.1f} KiB. Top allocations:')
+            for stat in snapshot.statistics('lineno')[:10]:
+                print(f'    {stat}')
+        else:
+            self._run_engine()
+
+        if self.cache_file:
+            for column, rule in self._cached_validators():
+                rule.save(self._column_cache_file(column))
+
+        print(f'{self.rows_read} rows were read: {self.rows_kept} kept, {self.rows_rejected} rejected.')
+        print(f'{self.rows_kept} rows were successfully filtered and written to {self.out_csv}')
+
+        stats = self.stats()
+        if 'cache_hits' in stats:
+            print(f'Validation cache: {stats["cache_hits"]} hits, {stats["cache_misses"]} misses.')
+
+        return stats
+
+    def _run_engine(self):
+        if self.incremental:
+            self._run_incremental()
+        elif self.engine == 'arrow':
+            self._run_arrow()
+        elif self.workers > 1:
+            self._run_parallel()
+        else:
+            self._run_sequential()
+
+    def _run_sequential(self):
+        ''' Row-based engine. Time spent on parsing, validation and writing is accumulated in `timings`. '''
+        self.timings = {'parse': 0.0, 'validate': 0.0, 'write': 0.0}
+
+        with open(self.in_csv, 'r', newline='', encoding=self.encoding) as in_file:
+            reader = csv.reader(in_file)
             headers = next(reader)
 
-            filtered_data = filter(lambda row: self.is_valid_login(row[self.filter_by_column]), list(reader))
+            with self.open_output(headers) as writer:
+                chunks = self.read_chunks(reader)
+                while True:
+                    started = time.perf_counter()
+                    chunk = next(chunks, None)
+                    parsed = time.perf_counter()
+                    if chunk is None:
+                        break
+
+                    rows = self.process_chunk(chunk)
+                    validated = time.perf_counter()
+                    writer.writerows(rows)
+
+                    self.timings['parse'] += parsed - started
+                    self.timings['validate'] += validated - parsed
+                    self.timings['write'] += time.perf_counter() - validated
+
+    def open_output(self, headers):
+        ''' Opens a writer of the output format with the projected header already written
+
+        :param headers: header row of the input CSV-file
+        '''
+        return make_sink(self.out_csv, self.output_format, header=self.project_row(headers), encoding=self.encoding).open()
+
+    def _run_incremental(self):
+        ''' Processes only the tail of the input which was appended since the previous run and appends
+        the filtered rows to `out_csv`. The input offset and the output size are saved to the checkpoint
+        file after every chunk, so an interrupted run resumes from the last saved chunk without duplicates.
+
+        Only complete (newline-terminated) records are processed: a partially written last record
+        is left for the next run. The input is reprocessed from scratch if its header or the
+        filter settings changed, or if it was truncated.
+        '''
+        header_end, = ProcessCSV.find_record_boundaries(self.in_csv, [0])
+        with open(self.in_csv, 'rb') as in_file:
+            header = in_file.read(header_end)
+
+        rules = sorted((column, rule.signature()) for column, rule in self.validators.items())
+        fingerprint = hashlib.sha1(header + repr((self.columns, rules)).encode()).hexdigest()
+        checkpoint = self.load_checkpoint()
+
+        if (checkpoint is None or checkpoint['fingerprint'] != fingerprint or not os.path.exists(self.out_csv)
+                or checkpoint['in_offset'] > os.path.getsize(self.in_csv)):
+            headers = next(csv.reader(io.StringIO(header.decode(self.encoding))))
+            with open(self.out_csv, 'w', newline='', encoding=self.encoding) as out_file:
+                csv.writer(out_file).writerow(self.project_row(headers))
+                checkpoint = {'fingerprint': fingerprint, 'in_offset': header_end, 'out_size': out_file.tell()}
+            self.save_checkpoint(checkpoint)
+        else:
+            # Drop the rows written after the last checkpoint by an interrupted run
+            os.truncate(self.out_csv, checkpoint['out_size'])
+
+        with open(self.in_csv, 'rb') as in_file, open(self.out_csv, 'a', newline='', encoding=self.encoding) as out_file:
+            in_file.seek(checkpoint['in_offset'])
+            records = self._read_records(in_file, checkpoint['in_offset'])
+            writer = csv.writer(out_file)
+
+            while True:
+                chunk = list(itertools.islice(records, self.chunk_size))
+                if not chunk:
+                    break
+
+                writer.writerows(self.process_chunk(list(csv.reader(record for record, _ in chunk))))
+                out_file.flush()
+
+                checkpoint['in_offset'] = chunk[-1][1]
+                checkpoint['out_size'] = out_file.tell()
+                self.save_checkpoint(checkpoint)
+
+    def _read_records(self, binary_file, offset):
+        ''' Yields complete records along with the input offset right after each of them.
 
-        with open(self.out_csv, 'w', newline='') as csv_file:
-            writer = csv.writer(csv_file)
-            headers = [headers[column] for column in self.columns]
-            writer.writerow(headers)
+        :param binary_file: input file opened in binary mode
+        :param offset: current position in the input file
+        '''
+        pending = b''
+        for line in iter(binary_file.readline, b''):
+            if not line.endswith(b'\n'):
+                return
+
+            pending += line
+            # A newline inside a quoted field: the record continues on the next line
+            if pending.count(b'"') % 2:
+                continue
+
+            offset += len(pending)
+            yield pending.decode(self.encoding), offset
+            pending = b''
+
+    def load_checkpoint(self):
+        try:
+            with open(self.checkpoint_file) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save_checkpoint(self, checkpoint):
+        tmp_file = self.checkpoint_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_file, self.checkpoint_file)
+
+    def _run_arrow(self):
+        ''' Columnar engine: loads only the required columns in record batches,
+        validates them with vectorized kernels and writes the projected columns in bulk.
+
+        Rows with another number of fields than the header (including blank lines) are checked with
+        the row-based rules. The row-based engine keeps such rows if they are valid, so when one is met
+        the file is processed with it instead and both engines produce the same output.
+        '''
+        if pa is None:
+            raise RuntimeError('pyarrow is required for the arrow engine: pip install pyarrow')
+
+        fallback = False
+
+        header_end, = ProcessCSV.find_record_boundaries(self.in_csv, [0])
+
+        with open(self.in_csv, 'rb') as in_file:
+            headers = next(csv.reader(io.StringIO(in_file.read(header_end).decode(self.encoding))))
+
+            # Positional names so that duplicate or empty headers don't get in the way
+            names = [f'c{column}' for column in range(len(headers))]
+            used = sorted(set(self.columns) | set(self.validators))
+
+            def handle_invalid_row(row):
+                nonlocal fallback
+                if self.is_valid_row(next(csv.reader(io.StringIO(row.text)), [])):
+                    fallback = True
+                    return 'error'
+
+                self.rows_read += 1
+                self.rows_rejected += 1
+                return 'skip'
+
+            try:
+                reader = pa_csv.open_csv(
+                    in_file,
+                    read_options=pa_csv.ReadOptions(column_names=names, encoding=self.encoding),
+                    parse_options=pa_csv.ParseOptions(
+                        newlines_in_values=True, ignore_empty_lines=False, invalid_row_handler=handle_invalid_row,
+                    ),
+                    convert_options=pa_csv.ConvertOptions(
+                        include_columns=[names[column] for column in used],
+                        column_types={names[column]: pa.string() for column in used},
+                    ),
+                )
 
-            for filtered_rows_count, filtered_row in enumerate(filtered_data, start=1):
-                row = [filtered_row[column] for column in self.columns]
-                writer.writerow(row)
+                with self.open_output(headers) as writer:
+                    # Parquet & Arrow writers take the columns as they are, other formats are written by rows
+                    columnar = hasattr(writer, 'write_columns')
+                    for batch in reader:
+                        mask = None
+                        for column, rule in self.validators.items():
+                            verdicts = rule.validate_array(batch.column(names[column]))
+                            mask = verdicts if mask is None else pc.and_(mask, verdicts)
 
-        print(f'{filtered_rows_count} rows were successfully filtered and written to {self.out_csv}')
+                        filtered = batch.filter(mask)
+                        if columnar:
+                            if filtered.num_rows:
+                                writer.write_columns([filtered.column(names[column]) for column in self.columns])
+                        else:
+                            writer.writerows(zip(*(filtered.column(names[column]).to_pylist() for column in self.columns)))
+
+                        self.rows_read += batch.num_rows
+                        self.rows_kept += filtered.num_rows
+                        self.rows_rejected += batch.num_rows - filtered.num_rows
+            except pa.ArrowInvalid:
+                if not fallback:
+                    raise
+
+        if fallback:
+            self.rows_read = self.rows_kept = self.rows_rejected = 0
+            self._run_sequential()
+
+    def _run_parallel(self):
+        size = os.path.getsize(self.in_csv)
+        targets = [0] + [size * part // self.workers for part in range(1, self.workers)]
+        header_end, *boundaries = ProcessCSV.find_record_boundaries(self.in_csv, targets)
+
+        with open(self.in_csv, 'rb') as in_file:
+            headers = next(csv.reader(io.StringIO(in_file.read(header_end).decode(self.encoding))))
+
+        offsets = [header_end] + [max(offset, header_end) for offset in boundaries] + [size]
+        ranges = [(start, end) for start, end in zip(offsets, offsets[1:]) if start < end]
+
+        out_dir = os.path.dirname(os.path.abspath(self.out_csv))
+        with tempfile.TemporaryDirectory(dir=out_dir) as tmp_dir:
+            parts = [os.path.join(tmp_dir, f'part-{seq:05d}.csv') for seq in range(len(ranges))]
+
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                results = executor.map(self._process_range, ranges, parts)
+
+                for stats in results:
+                    self.rows_read += stats['read']
+                    self.rows_kept += stats['kept']
+                    self.rows_rejected += stats['rejected']
+                    if 'cache_hits' in stats:
+                        self._worker_cache_info['hits'] += stats['cache_hits']
+                        self._worker_cache_info['misses'] += stats['cache_misses']
+                        # Values found valid by the workers are saved to `cache_file` along with the known ones
+                        for column, values in stats['new_valid'].items():
+                            self.validators[column].add_valid(values)
+
+            # Merge the parts in the original order
+            with open(self.out_csv, 'w', newline='', encoding=self.encoding) as out_file:
+                csv.writer(out_file).writerow(self.project_row(headers))
+                out_file.flush()
+
+                for part in parts:
+                    with open(part, 'rb') as part_file:
+                        shutil.copyfileobj(part_file, out_file.buffer)
+
+    def _process_range(self, byte_range, part_csv):
+        ''' Filters rows within the given byte range into a separate CSV-file.
+        Runs in a worker process.
+
+        :param byte_range: (start, end) offsets aligned to the record boundaries
+        :param part_csv: path to the CSV-file to write the filtered rows to
+
+        Returns the stats of the range along with the valid values found by the cached rules.
+        '''
+        start, end = byte_range
+
+        with open(self.in_csv, 'rb') as in_file, open(part_csv, 'w', newline='', encoding=self.encoding) as out_file:
+            in_file.seek(start)
+            reader = csv.reader(self._read_lines(in_file, end - start))
+            writer = csv.writer(out_file)
+
+            for chunk in self.read_chunks(reader):
+                writer.writerows(self.process_chunk(chunk))
+
+        stats = self.stats()
+        if 'cache_hits' in stats:
+            stats['new_valid'] = {column: list(rule.new_valid()) for column, rule in self._cached_validators()}
+
+        return stats
+
+    def _read_lines(self, binary_file, length):
+        while length > 0:
+            line = binary_file.readline()
+            if not line:
+                return
+            length -= len(line)
+            yield line.decode(self.encoding)
+
+    @staticmethod
+    def find_record_boundaries(path, targets, block_size=1 << 20):
+        ''' Finds the offsets right after the first record-ending newline at or after each target offset.
+
+        A newline ends a record only if the number of quotes before it is even,
+        so newlines inside quoted fields are skipped. Targets past the last record map to the file size.
+
+        :param path: path to the CSV-file
+        :param targets: sorted list of byte offsets
+        :param block_size: number of bytes to scan at once
+        '''
+        boundaries = []
+        pending = iter(targets)
+        target = next(pending, None)
+        position = quotes = 0
+
+        with open(path, 'rb') as f:
+            while target is not None:
+                block = f.read(block_size)
+                if not block:
+                    break
+
+                counted = 0
+                search_from = max(target - position, 0)
+                while target is not None:
+                    newline = block.find(b'\n', search_from)
+                    if newline == -1:
+                        break
+
+                    quotes += block.count(b'"', counted, newline)
+                    counted = newline
+
+                    if quotes % 2 == 0:
+                        boundaries.append(position + newline + 1)
+                        target = next(pending, None)
+                        if target is not None:
+                            search_from = max(target - position, newline + 1)
+                    else:
+                        search_from = newline + 1
+
+                quotes += block.count(b'"', counted)
+                position += len(block)
+
+        size = os.path.getsize(path)
+        while target is not None:
+            boundaries.append(size)
+            target = next(pending, None)
+
+        return boundaries
+
+    def stats(self):
+        stats = {
+            'read': self.rows_read,
+            'kept': self.rows_kept,
+            'rejected': self.rows_rejected,
+        }
+
+        cached_validators = self._cached_validators()
+        if cached_validators:
+            stats['cache_hits'] = self._worker_cache_info['hits']
+            stats['cache_misses'] = self._worker_cache_info['misses']
+            for _, rule in cached_validators:
+                info = rule.cache_info()
+                stats['cache_hits'] += info['hits']
+                stats['cache_misses'] += info['misses']
+
+        return stats
+
+    def _cached_validators(self):
+        return [(column, rule) for column, rule in self.validators.items() if isinstance(rule, CachedRule)]
+
+    def _column_cache_file(self, column):
+        return f'{self.cache_file}.{column}.json'
+
+    def read_chunks(self, reader):
+        ''' Yields lists of at most `chunk_size` rows from the reader.
+
+        :param reader: csv.reader (or any iterable of rows)
+        '''
+        while True:
+            chunk = list(itertools.islice(reader, self.chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+    def process_chunk(self, chunk):
+        ''' Validates and projects a chunk of rows. Rows which are too short to
+        contain all the required columns are rejected as well as rows failing any of the column rules.
+
+        :param chunk: list of rows
+        '''
+        min_length = max(*self.columns, *self.validators) + 1
+        rows = [row for row in chunk if len(row) >= min_length]
+
+        mask = None
+        for column, rule in self.validators.items():
+            verdicts = rule.validate_many([row[column] for row in rows])
+            mask = verdicts if mask is None else [a and b for a, b in zip(mask, verdicts)]
+
+        filtered = [self.project_row(row) for row, valid in zip(rows, mask) if valid]
+
+        self.rows_read += len(chunk)
+        self.rows_kept += len(filtered)
+        self.rows_rejected += len(chunk) - len(filtered)
+
+        return filtered
+
+    def is_valid_row(self, row):
+        ''' Row-at-a-time version of the `process_chunk` check '''
+        return len(row) > max(*self.columns, *self.validators) and all(
+            rule(row[column]) for column, rule in self.validators.items()
+        )
+
+    def to_pipeline(self):
+        ''' Returns the same filter as a generic `Pipeline`, e.g. to write the results to another sink:
+
+            processor.to_pipeline().run(JsonLinesSink('filtered.jsonl'), workers=4)
+
+        The stages are bound to the processor, so it's sent to every worker once (not with every chunk).
+        '''
+        source = CsvSource(self.in_csv, encoding=self.encoding)
+        return Pipeline(source).filter(self.is_valid_row).map(self.project_row)
+
+    def project_row(self, row):
+        return [row[column] for column in self.columns]
+
+    @staticmethod
+    def _init_validators(filter_by_column):
+        ''' Normalizes `filter_by_column` to a {column: rule} dict.
+
+        :param filter_by_column: column index to check with the login rule,
+            or a dict of {column index: rule name or `Rule` instance}
+        '''
+        if isinstance(filter_by_column, int):
+            return {filter_by_column: get_validator('login')}
+
+        return {column: get_validator(rule) for column, rule in filter_by_column.items()}
 
     def is_valid_login(self, login):
         ''' Validates user's login with the simplest way possible
@@ -59,54 +842,216 @@ class ProcessCSV:
 
         :param login: login to validate
         '''
-        return re.match('^[a-zA-Z]{1}[a-zA-Z0-9-]{1,13}[a-zA-Z0-9]{1}$', login)
+        return VALIDATORS['login'](login)
+
+    FIRST_NAMES = ['Chad', 'Julia', 'Jeremy', 'Amanda', 'Dennis', 'Darrell', 'Roy', 'Winifred', 'Mattie', 'Betty',
+                   'Steve', 'Charles', 'Mable', 'Lena', 'Blake', 'Elijah', 'Beatrice', 'Francis', 'Maggie', 'Gordon', ]
+
+    SECOND_NAMES = ['Weber', 'Yates', 'Watkins', 'Maldonado', 'Dean', 'Terry', 'Copeland', 'Stanley', 'Mendez', 'Delgado',
+                    'Goodwin', 'Willis', 'Shaw', 'Pope', 'McDonald', 'Mullins', 'Ryan', 'Schultz', 'Bradley', 'Hardy', ]
 
     @staticmethod
-    def generate_random_data(out_csv, num=100, force=False):
+    def generate_random_data(out_csv, num=100, force=False, seed=None, invalid_ratio=0.25, workers=1, batch_size=100_000):
         ''' Generates initial random data to work with.
 
+        Rows are generated in batches of `batch_size` rows, each seeded from `seed` and its index,
+        so the same seed gives the same file whatever the number of workers is.
+
         :param out_csv: path to the CSV-file to be generated
         :param num: number of rows to be generated
         :param force: force generation if file has already been generated
+        :param seed: seed to reproduce the data, random if not set
+        :param invalid_ratio: share of the rows with invalid logins
+        :param workers: number of processes to generate the batches in
+        :param batch_size: number of rows generated and written at once
         '''
-        first_name_list = ['Chad', 'Julia', 'Jeremy', 'Amanda', 'Dennis', 'Darrell', 'Roy', 'Winifred', 'Mattie', 'Betty',
-                           'Steve', 'Charles', 'Mable', 'Lena', 'Blake', 'Elijah', 'Beatrice', 'Francis', 'Maggie', 'Gordon', ]
-
-        second_name_list = ['Weber', 'Yates', 'Watkins', 'Maldonado', 'Dean', 'Terry', 'Copeland', 'Stanley', 'Mendez', 'Delgado',
-                            'Goodwin', 'Willis', 'Shaw', 'Pope', 'McDonald', 'Mullins', 'Ryan', 'Schultz', 'Bradley', 'Hardy', ]
-
         if not force and os.path.exists(out_csv):
             print('Data is already generated.')
             return
 
+        if seed is None:
+            seed = random.randrange(2 ** 32)
+
+        batches = [(start, min(batch_size, num - start), seed, invalid_ratio) for start in range(0, num, batch_size)]
+
         with open(out_csv, 'w', newline='') as csv_file:
-            writer = csv.writer(csv_file)
-            writer.writerow(['id', 'login', 'first_name', 'second_name', 'ip_address'])
+            csv_file.write('id,login,first_name,second_name,ip_address\r\n')
+
+            if workers > 1:
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    # Submit batches in bounded windows so generated data doesn't pile up in memory
+                    window = workers * 2
+                    for offset in range(0, len(batches), window):
+                        for data in executor.map(ProcessCSV._generate_batch, batches[offset:offset + window]):
+                            csv_file.write(data)
+            else:
+                for batch in batches:
+                    csv_file.write(ProcessCSV._generate_batch(batch))
+
+        print(f'{num} lines were successfully written to {out_csv} (seed: {seed}).')
+
+    @staticmethod
+    def _generate_batch(batch):
+        ''' Generates a batch of CSV-lines.
+
+        :param batch: (start, count, seed, invalid_ratio)
+        '''
+        start, count, seed, invalid_ratio = batch
+        rng = random.Random(f'{seed}:{start}')
+
+        first_names = rng.choices(ProcessCSV.FIRST_NAMES, k=count)
+        second_names = rng.choices(ProcessCSV.SECOND_NAMES, k=count)
+        octets = [str(octet) for octet in range(256)]
+        ips = ['.'.join(ip) for ip in zip(*[iter(rng.choices(octets[1:254], k=count * 4))] * 4)]
+
+        lines = []
+        for seq, first_name, second_name, ip in zip(range(start + 1, start + count + 1), first_names, second_names, ips):
+            login = first_name[0] + second_name
+
+            if rng.random() < invalid_ratio:
+                corruption = rng.randrange(3)
+                if corruption == 0:
+                    login = rng.choice('01234567890!@$%&*_-') + login
+                elif corruption == 1:
+                    login += rng.choice('-_.')
+                else:
+                    # Too long login
+                    login += '-' + ''.join(rng.choices(string.ascii_letters, k=16 - len(login)))
+
+            lines.append(f'{seq},{login},{first_name},{second_name},{ip}\r\n')
+
+        return ''.join(lines)
+
+
+def compare_engines(in_csv, out_dir, **kwargs):
+    ''' Runs the row-based and the columnar engines on the same input and compares their speed and output.
+
+    :param in_csv: path to the input CSV-file
+    :param out_dir: directory to write the outputs to
+    :param kwargs: other `ProcessCSV` arguments
+    '''
+    timings, outputs = {}, {}
+
+    for engine in ('python', 'arrow'):
+        outputs[engine] = os.path.join(out_dir, f'filtered-{engine}.csv')
+        processor = ProcessCSV(in_csv, outputs[engine], engine=engine, **kwargs)
+
+        started = time.perf_counter()
+        stats = processor.run()
+        timings[engine] = time.perf_counter() - started
+
+        print(f'{engine}: {timings[engine]:.3f}s, {stats["read"] / timings[engine]:,.0f} rows/s')
+
+    with open(outputs['python'], 'rb') as python_out, open(outputs['arrow'], 'rb') as arrow_out:
+        same = python_out.read() == arrow_out.read()
+
+    print(f'Speedup: x{timings["python"] / timings["arrow"]:.2f}. Outputs are {"identical" if same else "DIFFERENT"}.')
+
+    return timings
+
+
+def benchmark(out_json, sizes=(10_000, 1_000_000, 10_000_000), seed=2018, work_dir=None, trace_allocations=False):
+    ''' Benchmarks data generation and the row-based engine on fixed-seed inputs of the given sizes.
+    Each size is measured in a separate process, so the peak RSS isn't affected by the previous runs.
+
+    The results are saved to `out_json`. If the file already exists, the throughput is compared
+    with the previous results to catch regressions.
+
+    :param out_json: path to the JSON-file to save the results to
+    :param sizes: numbers of rows to benchmark
+    :param seed: seed of the generated inputs
+    :param work_dir: directory to keep the generated inputs in (they are reused between runs,
+        along with the time their generation took)
+    :param trace_allocations: additionally rerun every size under tracemalloc to measure the peak
+        of traced allocations. Off by default, as tracing makes the run several times slower:
+        pass it with small `sizes` only
+    '''
+    work_dir = work_dir or tempfile.gettempdir()
+
+    results = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'seed': seed,
+        'cases': [],
+    }
+
+    for num in sizes:
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            case = executor.submit(_benchmark_case, num, seed, work_dir, trace_allocations).result()
+
+        results['cases'].append(case)
+        print(f'{num:>12,} rows: {case["rows_per_s"]:>12,.0f} rows/s, '
+              f'parse {case["parse_s"]:.3f}s, validate {case["validate_s"]:.3f}s, write {case["write_s"]:.3f}s, '
+              f'peak RSS ' + (f'{case["peak_rss_kb"]:,} KiB' if case['peak_rss_kb'] is not None else 'n/a'))
+
+    if os.path.exists(out_json):
+        with open(out_json) as f:
+            previous = {case['rows']: case for case in json.load(f)['cases']}
+
+        for case in results['cases']:
+            if case['rows'] in previous:
+                change = case['rows_per_s'] / previous[case['rows']]['rows_per_s'] - 1
+                print(f'{case["rows"]:>12,} rows: {change:+.1%} rows/s compared to the previous run')
+
+    with open(out_json, 'w') as f:
+        json.dump(results, f, indent=4)
+
+    return results
+
+
+def _benchmark_case(num, seed, work_dir, trace_allocations):
+    in_csv = os.path.join(work_dir, f'bench-{num}-{seed}.csv')
+    out_csv = os.path.join(work_dir, f'bench-{num}-{seed}-filtered.csv')
+
+    # Inputs are generated once and reused by the next runs, along with the time it took to generate them
+    timing_json = in_csv + '.timing.json'
+    if not (os.path.exists(in_csv) and os.path.exists(timing_json)):
+        started = time.perf_counter()
+        ProcessCSV.generate_random_data(in_csv, num=num, seed=seed, force=True)
+        with open(timing_json, 'w') as f:
+            json.dump({'generate_s': time.perf_counter() - started}, f)
 
-            for seq, _ in enumerate(range(num), start=1):
-                row = []
+    with open(timing_json) as f:
+        generate_s = json.load(f)['generate_s']
 
-                first_name = random.choice(first_name_list)
-                second_name = random.choice(second_name_list)
+    processor = ProcessCSV(in_csv, out_csv)
+    started = time.perf_counter()
+    stats = processor.run()
+    total_s = time.perf_counter() - started
 
-                login_prefix = random.choice("01234567890!@$%&*_-") if random.random() < 0.1 else ""
-                login_suffix = random.choice('-_.') if random.random() < 0.1 else ""
-                garbage = '-' + ''.join(random.choice(string.ascii_letters) for _ in range(random.randint(0, 10)))
-                login_extender = garbage if random.random() < 0.15 else ""
+    case = {
+        'rows': num,
+        'generate_s': generate_s,
+        'total_s': total_s,
+        'rows_per_s': stats['read'] / total_s,
+        'parse_s': processor.timings['parse'],
+        'validate_s': processor.timings['validate'],
+        'write_s': processor.timings['write'],
+        'peak_rss_kb': _peak_rss_kb(),
+        'peak_traced_bytes': None,
+        **stats,
+    }
 
-                login = login_prefix + first_name[0] + second_name + login_extender + login_suffix
+    if trace_allocations:
+        tracemalloc.start()
+        try:
+            ProcessCSV(in_csv, out_csv).run()
+            case['peak_traced_bytes'] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
 
-                ip = ".".join(str(random.randrange(1, 254)) for _ in range(4))
+    return case
 
-                row.append(seq)
-                row.append(login)
-                row.append(first_name)
-                row.append(second_name)
-                row.append(ip)
 
-                writer.writerow(row)
+def _peak_rss_kb():
+    try:
+        # Unix only
+        import resource
+    except ImportError:
+        return None
 
-            print(f'{seq} lines were successfully written to {out_csv}.')
+    # Kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
 
 
 def main():
@@ -115,9 +1060,20 @@ def main():
 
     # Generate initial random date to work with
     # ProcessCSV.generate_random_data(IN_CSV, num=2000, force=True)
+    # Use `seed` to reproduce the same data and `workers` to generate large files faster
 
     # Two main columns are: 1 and 4 (login and ip_address)
     # Colunmn with user's login is 1
+    # Several columns can be checked at once, e.g. filter_by_column={1: 'login', 4: 'ipv4'}
+    # Use `workers=os.cpu_count()` to filter large files on all the cores
+    # or `engine='arrow'` for the columnar engine (requires pyarrow).
+    # `incremental=True` processes only the rows appended since the previous run.
+    # `cache_size=N` memoizes verdicts for repetitive logins, `cache_file` keeps valid ones between runs.
+    # Output format follows the OUT_CSV extension (.csv.gz, .csv.zst, .parquet, .arrow) or `output_format`.
+    # compare_engines(IN_CSV, os.path.dirname(OUT_CSV)) benchmarks both of them.
+    # benchmark('benchmark.json') measures the whole pipeline on 10K, 1M and 10M rows
+    # (add `sizes=(10_000,), trace_allocations=True` for the peak of traced allocations);
+    # `profile='cpu'` or `profile='memory'` shows where time and memory go on real files.
     processor = ProcessCSV(IN_CSV, OUT_CSV, columns=(1, 4), filter_by_column=1)
     processor.run()
 
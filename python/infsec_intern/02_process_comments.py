@@ -1,7 +1,15 @@
-import csv
+import hashlib
+import http.client
 import json
 import os
+import queue
+import time
+import urllib.error
+import urllib.parse
 import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from pipeline import HttpJsonSource, Pipeline, make_sink
 
 '''
 Vacancy: https://yandex.ru/jobs/vacancies/interns/infsec_intern/
@@ -16,52 +24,398 @@ Vacancy: https://yandex.ru/jobs/vacancies/interns/infsec_intern/
 - words_count — количество слов из поля name.
 '''
 
+# Column types for Parquet & Arrow outputs
+CSV_SCHEMA = [('email', 'string'), ('words_count', 'int64')]
+
+
+class ConnectionPool:
+    ''' Pool of keep-alive HTTP connections to a single host, safe to share between threads.
+
+    :param url: any URL of the host
+    :param timeout: socket timeout in seconds
+    '''
+    def __init__(self, url, timeout=30):
+        parts = urllib.parse.urlsplit(url)
+        self.connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.host = parts.netloc
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+
+    def request(self, method, path, headers=None):
+        ''' Sends a request over an idle connection (or a new one) and reads the whole response.
+
+        :return: (status, headers, body)
+        '''
+        try:
+            connection = self._idle.get_nowait()
+        except queue.Empty:
+            connection = self.connection_class(self.host, timeout=self.timeout)
+
+        try:
+            connection.request(method, path, headers=headers or {})
+            response = connection.getresponse()
+            body = response.read()
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            raise
+
+        if response.will_close:
+            connection.close()
+        else:
+            self._idle.put(connection)
+
+        return response.status, response.headers, body
+
+    def close(self):
+        while not self._idle.empty():
+            self._idle.get_nowait().close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class ResponseCache:
+    ''' On-disk cache of HTTP-responses keyed by URL.
+
+    Bodies are stored along with their ETag & Last-Modified headers to revalidate them with
+    conditional requests. Rows filtered from a body can be stored too, so they are reused as is
+    when the server replies with 304 Not Modified.
+
+    :param cache_dir: directory to store the responses in
+    :param ttl: entries not used for `ttl` seconds are evicted
+    :param max_size: total size of the cache in bytes, least recently used entries are evicted first
+    '''
+    def __init__(self, cache_dir, ttl=7 * 24 * 3600, max_size=1024 ** 3):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_size = max_size
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _path(self, url, kind):
+        key = hashlib.sha1(url.encode()).hexdigest()
+        return os.path.join(self.cache_dir, f'{key}.{kind}')
+
+    def _entry_files(self, key):
+        return [os.path.join(self.cache_dir, f'{key}.{kind}') for kind in ('meta', 'body', 'rows')]
+
+    def _load_meta(self, url):
+        try:
+            with open(self._path(url, 'meta')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, path, data):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def conditional_headers(self, url):
+        ''' Returns If-None-Match & If-Modified-Since headers for the cached response, if any '''
+        meta = self._load_meta(url)
+        if meta is None or not os.path.exists(self._path(url, 'body')):
+            return {}
+
+        headers = {}
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+        return headers
+
+    def store(self, url, headers, body):
+        ''' Stores the response body. Rows stored for the previous body are dropped. '''
+        try:
+            os.remove(self._path(url, 'rows'))
+        except FileNotFoundError:
+            pass
+
+        self._write(self._path(url, 'body'), body)
+        meta = {'url': url, 'etag': headers.get('ETag'), 'last_modified': headers.get('Last-Modified')}
+        self._write(self._path(url, 'meta'), json.dumps(meta).encode())
+
+        self.evict()
+
+    def get_body(self, url):
+        try:
+            with open(self._path(url, 'body'), 'rb') as f:
+                body = f.read()
+        except OSError:
+            return None
+
+        self.touch(url)
+        return body
+
+    def store_rows(self, url, rows):
+        self._write(self._path(url, 'rows'), json.dumps(rows).encode())
+
+    def get_rows(self, url):
+        try:
+            with open(self._path(url, 'rows')) as f:
+                rows = [tuple(row) for row in json.load(f)]
+        except (OSError, ValueError):
+            return None
+
+        self.touch(url)
+        return rows
+
+    def touch(self, url):
+        ''' Marks the entry as recently used '''
+        try:
+            os.utime(self._path(url, 'meta'))
+        except OSError:
+            pass
+
+    def evict(self):
+        ''' Removes entries not used for `ttl` seconds and then the least recently used ones
+        until the cache fits `max_size`.
+        '''
+        used_at, sizes = {}, {}
+        for name in os.listdir(self.cache_dir):
+            key, _, kind = name.partition('.')
+            if kind == 'meta':
+                used_at[key] = os.path.getmtime(os.path.join(self.cache_dir, name))
+                sizes[key] = sum(os.path.getsize(path) for path in self._entry_files(key) if os.path.exists(path))
+
+        now = time.time()
+        total = sum(sizes.values())
+
+        for key in sorted(used_at, key=used_at.get):
+            expired = self.ttl is not None and now - used_at[key] > self.ttl
+            if not expired and (self.max_size is None or total <= self.max_size):
+                break
+
+            for path in self._entry_files(key):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            total -= sizes[key]
+
+
+def fetch(pool, url, retries=3, backoff=0.5):
+    ''' GETs the URL through the pool. Connection errors, 429 and 5xx responses are retried
+    with exponential backoff. Raises `urllib.error.URLError` when retries are exhausted.
+
+    :param pool: `ConnectionPool` to the URL's host
+    :param url: URL to GET
+    :param retries: number of retries
+    :param backoff: delay before the first retry in seconds, doubled on every next one
+    :return: (headers, body)
+    '''
+    parts = urllib.parse.urlsplit(url)
+    path = urllib.parse.urlunsplit(('', '', parts.path or '/', parts.query, ''))
+
+    for attempt in range(retries + 1):
+        if attempt:
+            time.sleep(backoff * 2 ** (attempt - 1))
+
+        try:
+            status, headers, body = pool.request('GET', path, headers={'Accept': 'application/json'})
+        except (OSError, http.client.HTTPException) as err:
+            error = urllib.error.URLError(err)
+            continue
+
+        if status == 429 or status >= 500:
+            error = urllib.error.HTTPError(url, status, f'HTTP {status}', headers, None)
+            continue
+        if status >= 400:
+            raise urllib.error.HTTPError(url, status, f'HTTP {status}', headers, None)
+
+        return headers, body
+
+    raise error
+
 
-def load_filtered_json_data(json_url):
+def page_url(json_url, start, limit):
+    ''' Adds `_start` & `_limit` pagination params to the URL '''
+    parts = urllib.parse.urlsplit(json_url)
+    query = urllib.parse.parse_qsl(parts.query) + [('_start', start), ('_limit', limit)]
+    return urllib.parse.urlunsplit(parts._replace(query=urllib.parse.urlencode(query)))
+
+
+def fetch_json_pages(json_url, page_size=100, concurrency=8, retries=3, backoff=0.5, timeout=30):
+    ''' Fetches a paginated JSON-array concurrently using `_start` & `_limit` params.
+
+    The total number of objects is taken from the `X-Total-Count` header of the first page.
+    If the API doesn't send it, pages are fetched in batches of `concurrency` until a short page is met.
+
+    :param json_url: URL to the json-dataset
+    :param page_size: number of objects per page
+    :param concurrency: max number of simultaneous requests
+    :param retries: number of retries per page
+    :param backoff: delay before the first retry in seconds
+    :param timeout: socket timeout in seconds
+    :return: list of objects in the original order
+    '''
+    with ConnectionPool(json_url, timeout=timeout) as pool, ThreadPoolExecutor(max_workers=concurrency) as executor:
+        def fetch_page(start):
+            _, body = fetch(pool, page_url(json_url, start, page_size), retries=retries, backoff=backoff)
+            return json.loads(body)
+
+        headers, body = fetch(pool, page_url(json_url, 0, page_size), retries=retries, backoff=backoff)
+        data = json.loads(body)
+        total = headers.get('X-Total-Count')
+
+        if total is not None:
+            for page in executor.map(fetch_page, range(page_size, int(total), page_size)):
+                data.extend(page)
+            return data
+
+        start = page_size
+        last_page = data
+        while len(last_page) == page_size:
+            starts = range(start, start + page_size * concurrency, page_size)
+            for last_page in executor.map(fetch_page, starts):
+                data.extend(last_page)
+                if len(last_page) < page_size:
+                    break
+            start = starts[-1] + page_size
+
+        return data
+
+
+def filter_json_objects(objects):
+    ''' Yields (email, words_count) rows for the valid objects, filtered by the shared `Pipeline`
+
+    :param objects: iterable of json objects
+    '''
+    obj_count = 0
+
+    def count_objects():
+        nonlocal obj_count
+        for obj_count, obj in enumerate(objects, start=1):
+            yield obj
+
+    yield from Pipeline(count_objects()).filter(is_vaid_object).map(to_csv_row)
+
+    print(f'{obj_count} json objects were successfully processed.')
+
+
+def to_csv_row(json_object):
+    ''' Projects json object to the (email, words_count) row '''
+    return json_object['email'], len(json_object['name'].split())
+
+
+def export_filtered_json_data(json_url, out_file, workers=1, output_format=None):
+    ''' Streams the json-dataset from the URL straight to a CSV-file through the generic `Pipeline`.
+
+    :param json_url: URL to the json-dataset
+    :param out_file: path to the CSV-file to be saved
+    :param workers: number of processes to filter the objects in
+    :param output_format: see `save_csv_data`
+    '''
+    pipeline = Pipeline(HttpJsonSource(json_url)).filter(is_vaid_object).map(to_csv_row)
+    sink = make_sink(out_file, output_format, header=[name for name, _ in CSV_SCHEMA], schema=CSV_SCHEMA)
+
+    try:
+        rows_count = pipeline.run(sink, workers=workers)
+        print(f'{rows_count} lines were successfully written to {out_file}.')
+
+    except (OSError, ValueError, http.client.HTTPException) as err:
+        print(f'An error occured: {err}')
+
+
+def stream_filtered_json_data(json_url):
+    ''' Same as `load_filtered_json_data`, but parses the response while it's being downloaded
+    and yields the filtered rows one by one, so the response is never kept in memory as a whole.
+    Network errors and invalid or truncated data are raised to the consumer (e.g. `save_csv_data`),
+    so a partial result is never taken for a complete one.
+
+    :param json_url: URL to the json-dataset
+    '''
+    yield from filter_json_objects(HttpJsonSource(json_url))
+
+
+def load_filtered_json_data(json_url, page_size=None, concurrency=8, cache=None):
     ''' Loads raw json data from the given URL and filters it according to the requirements
 
     :param json_url: URL to the json-dataset
+    :param page_size: if set, the data is fetched concurrently by pages of this size
+    :param concurrency: max number of simultaneous requests for the paginated fetch
+    :param cache: `ResponseCache` to revalidate the data with instead of downloading it again
+        (not used for the paginated fetch)
     '''
     filtered_data = []
 
     try:
-        with urllib.request.urlopen(json_url) as url:
-            data = json.loads(url.read().decode())
+        if page_size:
+            data = fetch_json_pages(json_url, page_size=page_size, concurrency=concurrency)
+            filtered_data = list(filter_json_objects(data))
+        elif cache:
+            filtered_data = load_cached_filtered_json_data(json_url, cache)
+        else:
+            with urllib.request.urlopen(json_url) as url:
+                data = json.loads(url.read().decode())
+            filtered_data = list(filter_json_objects(data))
 
-            for obj_count, obj in enumerate(data, start=1):
-                if is_vaid_object(obj):
-                    email = obj['email']
-                    word_count = len(obj['name'].split())
+    except (urllib.error.URLError, http.client.HTTPException, ValueError) as err:
+        print(f'An error occured: {err}')
 
-                    row = email, word_count
-                    filtered_data.append(row)
+    return filtered_data
 
-            print(f'{obj_count} json objects were successfully processed.')
 
-    except urllib.error.URLError as err:
-        print(f'An error occured: {err}')
+def load_cached_filtered_json_data(json_url, cache):
+    ''' Sends a conditional request for the cached data. If the data is not modified,
+    the previously filtered rows (or the cached body) are reused.
+
+    :param json_url: URL to the json-dataset
+    :param cache: `ResponseCache` instance
+    '''
+    request = urllib.request.Request(json_url, headers=cache.conditional_headers(json_url))
+
+    try:
+        with urllib.request.urlopen(request) as url:
+            body = url.read()
+            cache.store(json_url, url.headers, body)
+
+    except urllib.error.HTTPError as err:
+        if err.code != 304:
+            raise
+
+        filtered_data = cache.get_rows(json_url)
+        if filtered_data is not None:
+            print(f'Data is not modified. {len(filtered_data)} cached rows are reused.')
+            return filtered_data
 
-    finally:
-        return filtered_data
+        body = cache.get_body(json_url)
+        if body is None:
+            # The entry was evicted (e.g. by another process) after the conditional headers were sent
+            print('Data is not modified, but the cached response is gone. Downloading it again...')
+            with urllib.request.urlopen(json_url) as url:
+                body = url.read()
+                cache.store(json_url, url.headers, body)
+        else:
+            print('Data is not modified. Cached response is reused.')
 
+    filtered_data = list(filter_json_objects(json.loads(body.decode())))
+    cache.store_rows(json_url, filtered_data)
 
-def save_csv_data(data, out_file):
+    return filtered_data
+
+
+def save_csv_data(data, out_file, output_format=None):
     ''' Saves data filtered by `load_filtered_json_data` function to a CSV-file.
 
-    :param data: data, filtered by `load_filtered_json_data` function
+    :param data: data, filtered by `load_filtered_json_data` function (or a generator of rows).
+        The file is replaced only when all the rows are written: if the generator fails,
+        the previous file is kept
     :param out_file: path to the CSV-file to be saved
+    :param output_format: 'csv' (default), 'csv.gz', 'csv.zst', 'parquet' or 'arrow',
+        detected by the `out_file` extension if not set
     '''
     try:
-        with open(out_file, 'w', newline='') as csv_file:
-            writer = csv.writer(csv_file)
-            writer.writerow(['email', 'words_count'])
-
-            for rows_count, row in enumerate(data, start=1):
-                writer.writerow(row)
+        sink = make_sink(out_file, output_format, header=[name for name, _ in CSV_SCHEMA], schema=CSV_SCHEMA)
+        rows_count = sink.write(data)
 
-            print(f'{rows_count} lines were successfully written to {out_file}.')
+        print(f'{rows_count} lines were successfully written to {out_file}.')
 
-    except OSError as err:
+    except (OSError, ValueError, http.client.HTTPException) as err:
         print(f'An error occured: {err}')
 
 
@@ -78,8 +432,14 @@ def is_vaid_object(json_object):
 def main():
     URL = 'https://jsonplaceholder.typicode.com/comments'
     OUT_CSV = os.path.join(os.path.dirname(__file__), 'json-filtered-data.csv')
+    CACHE_DIR = os.path.join(os.path.dirname(__file__), '.http-cache')
 
-    filtered_data = load_filtered_json_data(json_url=URL)
+    # Use `page_size=100` to fetch large datasets by pages concurrently
+    # or save_csv_data(data=stream_filtered_json_data(URL), out_file=OUT_CSV)
+    # to filter the rows while the response is being downloaded, without keeping it in memory,
+    # export_filtered_json_data(URL, OUT_CSV, workers=4) does the same filtering the objects in worker processes.
+    # Pass `output_format='parquet'` (or 'arrow', 'csv.gz', 'csv.zst') to get typed or compressed output
+    filtered_data = load_filtered_json_data(json_url=URL, cache=ResponseCache(CACHE_DIR))
 
     if not filtered_data:
         print('No data to process. Exiting...')
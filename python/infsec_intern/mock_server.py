@@ -0,0 +1,181 @@
+'''
+Local mock of the comments API (https://jsonplaceholder.typicode.com/comments) used by `02_process_comments.py`,
+so the paginated fetch can be run and checked without the real API:
+    GET /comments                        - all the comments
+    GET /comments?_start=<n>&_limit=<n>  - a page of the comments, with the X-Total-Count header
+
+Behaviour of the server can be changed on the fly with `MockCommentsAPI.settings`:
+    total_count - send the X-Total-Count header with the pages
+    max_delay   - every page is delayed by a random time up to that many seconds,
+                  so the concurrent requests complete out of order
+    flaky       - number of the next requests to answer with 429 and 503 in turn
+
+How to Run:
+    $ {path_to_python} mock_server.py
+
+    Starts the mock server and runs the fetch of `02_process_comments.py` against it.
+'''
+
+import importlib.util
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, status, body, headers=None):
+        body = json.dumps(body).encode()
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        mock = self.server.mock
+        url = urlsplit(self.path)
+        query = {name: values[0] for name, values in parse_qs(url.query).items()}
+        mock.requests.append(self.path)
+
+        if url.path != '/comments':
+            return self.send(404, {})
+
+        status = mock.next_failure()
+        if status:
+            return self.send(status, {}, {'Retry-After': '0'})
+
+        if '_start' not in query and '_limit' not in query:
+            return self.send(200, mock.comments)
+
+        start = int(query.get('_start', 0))
+        limit = int(query.get('_limit', len(mock.comments)))
+        time.sleep(random.uniform(0, mock.settings['max_delay']))
+
+        headers = {'X-Total-Count': str(len(mock.comments))} if mock.settings['total_count'] else {}
+        self.send(200, mock.comments[start:start + limit], headers)
+
+
+class MockCommentsAPI:
+    def __init__(self, host='127.0.0.1', port=0, num=500, seed=2018):
+        '''
+        :param num: number of the generated comments
+        :param seed: seed of the generated comments
+        '''
+        self.comments = self.generate_comments(num, seed)
+        self.settings = {'total_count': True, 'max_delay': 0.0, 'flaky': 0}
+        self.requests = []
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), MockHandler)
+        self.server.mock = self
+        self.url = f'http://{host}:{self.server.server_address[1]}/comments'
+
+    @staticmethod
+    def generate_comments(num, seed):
+        ''' Comments in the format of the real API, a part of them with .info emails and short names '''
+        rnd = random.Random(seed)
+        words = ['lorem', 'ipsum', 'dolor', 'sit', 'amet', 'quia', 'et', 'vero']
+
+        return [{
+            'postId': i // 5 + 1,
+            'id': i + 1,
+            'name': ' '.join(rnd.choices(words, k=rnd.randint(1, 6))),
+            'email': f'user{i}@example.{rnd.choice(["info", "com", "org", "biz"])}',
+            'body': ' '.join(rnd.choices(words, k=20)),
+        } for i in range(num)]
+
+    def next_failure(self):
+        ''' Status to fail the request with, if the server is set to be flaky '''
+        with self._lock:
+            if not self.settings['flaky']:
+                return None
+            self.settings['flaky'] -= 1
+            return 429 if self.settings['flaky'] % 2 else 503
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def load_processor():
+    ''' Imports `02_process_comments.py`, which can't be imported by its name '''
+    directory = os.path.dirname(os.path.abspath(__file__))
+    if directory not in sys.path:
+        # For its `pipeline` import
+        sys.path.insert(0, directory)
+
+    spec = importlib.util.spec_from_file_location('process_comments', os.path.join(directory, '02_process_comments.py'))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def main():
+    comments = load_processor()
+    mock = MockCommentsAPI().start()
+
+    with urllib.request.urlopen(mock.url) as response:
+        expected = json.loads(response.read())
+    assert expected == mock.comments
+
+    # The total is taken from X-Total-Count, pages completing out of order are put back in order
+    mock.settings['max_delay'] = 0.05
+    data = comments.fetch_json_pages(mock.url, page_size=30, concurrency=8)
+    print(f'X-Total-Count: {len(data)} comments in {len(mock.requests) - 1} requests')
+    assert data == expected
+
+    # Without X-Total-Count, pages are fetched until a short one is met
+    mock.settings['total_count'] = False
+    for page_size in (30, 50, 1000):
+        data = comments.fetch_json_pages(mock.url, page_size=page_size, concurrency=4)
+        print(f'Short page (page size {page_size}): {len(data)} comments')
+        assert data == expected
+
+    # 429 & 5xx responses are retried
+    mock.settings['total_count'] = True
+    mock.settings['flaky'] = 4
+    data = comments.fetch_json_pages(mock.url, page_size=30, concurrency=8, retries=4, backoff=0.01)
+    print(f'Retried: {len(data)} comments')
+    assert data == expected and not mock.settings['flaky']
+
+    # When retries are exhausted, the error is raised
+    mock.settings['flaky'] = 10
+    try:
+        comments.fetch_json_pages(mock.url, page_size=30, retries=2, backoff=0.01)
+    except urllib.error.HTTPError as err:
+        print(f'Retries exhausted: {err}')
+    else:
+        raise AssertionError('HTTPError is expected')
+    mock.settings['flaky'] = 0
+
+    # Paged and unpaged fetches give the same rows
+    paged = comments.load_filtered_json_data(mock.url, page_size=30)
+    unpaged = comments.load_filtered_json_data(mock.url)
+    print(f'Filtered: {len(paged)} paged and {len(unpaged)} unpaged rows')
+    assert paged == unpaged and paged
+
+    mock.stop()
+    print('All checks passed!')
+
+
+if __name__ == '__main__':
+    main()
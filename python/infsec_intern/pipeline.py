@@ -0,0 +1,468 @@
+import codecs
+import csv
+import gzip
+import io
+import json
+import os
+import urllib.request
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+'''
+Lazy filter/projection pipeline shared by the infsec scripts.
+
+    Pipeline(source).filter(predicate).map(function).run(sink, workers=N)
+
+Sources and sinks are plain iterables and objects with a `write(items)` method,
+the ones below cover CSV-files, JSON-arrays (files or HTTP-responses), JSON Lines,
+compressed CSV (gzip, zstd), Parquet and Arrow IPC (the last three need optional packages).
+Stages are applied with the builtin `filter` & `map`, so they are fused into a single lazy pass
+without intermediate lists. With `workers` > 1 the items are processed in chunks in worker processes,
+so the stages must be picklable (module-level functions, bound methods, `Rule` objects, etc.).
+They are sent to every worker once, only the chunks are sent along with the tasks.
+'''
+
+
+def iter_json_array(stream, chunk_size=64 * 1024, encoding='utf-8'):
+    ''' Parses a top-level JSON-array from a binary stream element by element,
+    so only the current element and one chunk are kept in memory.
+
+    :param stream: binary file-like object, e.g. HTTP-response
+    :param chunk_size: number of bytes to read at once
+    :param encoding: encoding of the stream
+    '''
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder(encoding)()
+    buffer, pos, eof = '', 0, False
+
+    def read_more():
+        nonlocal buffer, pos, eof
+        chunk = stream.read(chunk_size)
+        eof = not chunk
+        buffer = buffer[pos:] + text_decoder.decode(chunk, final=eof)
+        pos = 0
+
+    def next_char():
+        # Skips whitespaces and returns the next significant char (or '' at the end of the stream)
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\n\r':
+                pos += 1
+            if pos < len(buffer) or eof:
+                return buffer[pos:pos + 1]
+            read_more()
+
+    if next_char() != '[':
+        raise ValueError('JSON-array expected')
+    pos += 1
+
+    if next_char() == ']':
+        return
+
+    while True:
+        next_char()
+        try:
+            obj, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError as err:
+            # Only an element cut by the end of the buffer is worth reading more: any other error
+            # is raised right away, instead of buffering the rest of the stream
+            if eof or not _is_cut_off(buffer, err):
+                raise ValueError(f'Invalid or truncated JSON-array: {err}') from None
+            read_more()
+            continue
+
+        # Numbers are ambiguous (e.g. '2.' of '2.5' is decoded as 2), so a number running up to the end
+        # of the buffer may continue in the next chunk
+        incomplete = end == len(buffer) or (type(obj) in (int, float) and NUMBER_CHARS.issuperset(buffer[end:]))
+        if incomplete and not eof:
+            read_more()
+            continue
+
+        pos = end
+        yield obj
+
+        char = next_char()
+        if char == ']':
+            return
+        if char != ',':
+            raise ValueError(f'Unexpected {char!r} in JSON-array')
+        pos += 1
+
+
+NUMBER_CHARS = frozenset('0123456789+-.eE')
+JSON_LITERALS = ('true', 'false', 'null', 'NaN', 'Infinity', '-Infinity')
+
+
+def _is_cut_off(buffer, err):
+    ''' Checks if the JSON decoding error is caused by the end of the buffer rather than by invalid data
+
+    :param buffer: decoded text
+    :param err: json.JSONDecodeError raised for the buffer
+    '''
+    rest = buffer[err.pos:]
+    # A nested number cut after its integer part (e.g. '1.' of '[1.5') fails on the delimiter after it
+    if not rest.strip() or NUMBER_CHARS.issuperset(rest) or err.msg.startswith('Unterminated string'):
+        return True
+    if err.msg == 'Expecting value':
+        # A literal or a sign of a number, e.g. 'tr' of 'true' or '-' of '-1'
+        return any(literal.startswith(rest) for literal in JSON_LITERALS)
+    if err.msg.startswith('Invalid \\uXXXX escape'):
+        return len(rest) < 6
+
+    return False
+
+
+class CsvSource:
+    ''' Rows of a CSV-file
+
+    :param path: path to the CSV-file
+    :param skip_header: don't yield the first row
+    :param encoding: encoding of the file
+    '''
+    def __init__(self, path, skip_header=True, encoding='utf-8'):
+        self.path = path
+        self.skip_header = skip_header
+        self.encoding = encoding
+
+    def read_header(self):
+        with open(self.path, newline='', encoding=self.encoding) as f:
+            return next(csv.reader(f), None)
+
+    def __iter__(self):
+        with open(self.path, newline='', encoding=self.encoding) as f:
+            reader = csv.reader(f)
+            if self.skip_header:
+                next(reader, None)
+            yield from reader
+
+
+class JsonArraySource:
+    ''' Elements of a JSON-array stored in a file, parsed in a streaming manner
+
+    :param path: path to the JSON-file
+    '''
+    def __init__(self, path):
+        self.path = path
+
+    def __iter__(self):
+        with open(self.path, 'rb') as f:
+            yield from iter_json_array(f)
+
+
+class HttpJsonSource:
+    ''' Elements of a JSON-array parsed while the HTTP-response is being downloaded
+
+    :param url: URL to the JSON-array
+    :param timeout: socket timeout in seconds
+    '''
+    def __init__(self, url, timeout=60):
+        self.url = url
+        self.timeout = timeout
+
+    def __iter__(self):
+        with urllib.request.urlopen(self.url, timeout=self.timeout) as response:
+            yield from iter_json_array(response)
+
+
+OUTPUT_FORMATS = {
+    '.csv': 'csv',
+    '.gz': 'csv.gz',
+    '.zst': 'csv.zst',
+    '.parquet': 'parquet',
+    '.arrow': 'arrow',
+    '.feather': 'arrow',
+    '.jsonl': 'jsonl',
+}
+
+CSV_COMPRESSIONS = {
+    'csv': None,
+    'csv.gz': 'gzip',
+    'csv.zst': 'zstd',
+}
+
+
+def detect_format(path):
+    ''' Guesses the output format by the file extension, CSV by default '''
+    return OUTPUT_FORMATS.get(os.path.splitext(path)[1].lower(), 'csv')
+
+
+def make_sink(path, output_format=None, header=None, schema=None, encoding='utf-8'):
+    ''' Creates a sink for the output format
+
+    :param path: path to the output file
+    :param output_format: one of 'csv', 'csv.gz', 'csv.zst', 'parquet', 'arrow', 'jsonl',
+        detected by the file extension if not set
+    :param header: column names
+    :param schema: list of (name, type) for Parquet & Arrow, e.g. [('email', 'string'), ('words_count', 'int64')].
+        All the columns from the header are strings by default
+    '''
+    output_format = output_format or detect_format(path)
+
+    if output_format in CSV_COMPRESSIONS:
+        return CsvSink(path, header=header, encoding=encoding, compression=CSV_COMPRESSIONS[output_format])
+    if output_format in ('parquet', 'arrow'):
+        return ArrowSink(path, schema or [(name, 'string') for name in header], output_format=output_format)
+    if output_format == 'jsonl':
+        return JsonLinesSink(path)
+
+    raise ValueError(f'Unknown output format: {output_format!r}')
+
+
+def open_text(path, mode='w', compression=None, encoding='utf-8', buffer_size=1 << 20):
+    ''' Opens a text file for CSV-writing, optionally compressed with gzip or zstd
+
+    :param path: path to the file
+    :param mode: 'w' or 'a' (appending to compressed files adds a new gzip member / zstd frame)
+    :param compression: None, 'gzip' or 'zstd'
+    :param buffer_size: size of the write buffer in bytes
+    '''
+    if compression is None:
+        return open(path, mode, newline='', encoding=encoding, buffering=buffer_size)
+
+    if compression == 'gzip':
+        binary = gzip.open(path, mode + 'b', compresslevel=6)
+    elif compression == 'zstd':
+        if zstandard is None:
+            raise RuntimeError('zstandard is required for zstd compression: pip install zstandard')
+        binary = zstandard.open(path, mode + 'b')
+    else:
+        raise ValueError(f'Unknown compression: {compression!r}')
+
+    # Compressors work best with large writes
+    return io.TextIOWrapper(io.BufferedWriter(binary, buffer_size), encoding=encoding, newline='')
+
+
+class Sink:
+    ''' Base class for the sinks: `open(path)` returns a writer with `writerows(rows)` & `close()` methods '''
+    mode = 'w'
+
+    def open(self, path=None):
+        raise NotImplementedError
+
+    def write(self, items, chunk_size=10_000):
+        ''' Writes all the items and returns their number.
+
+        Unless appending, the items are written to a temporary file, which replaces the output file
+        only when all of them are written, so a failing source doesn't clobber the previous output.
+        '''
+        items = iter(items)
+        count = 0
+        path = self.path + '.tmp' if self.mode == 'w' else self.path
+
+        try:
+            with self.open(path) as writer:
+                for chunk in iter(lambda: list(islice(items, chunk_size)), []):
+                    writer.writerows(chunk)
+                    count += len(chunk)
+        except BaseException:
+            if path != self.path and os.path.exists(path):
+                os.remove(path)
+            raise
+
+        if path != self.path:
+            os.replace(path, self.path)
+
+        return count
+
+
+class _Writer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class CsvSink(Sink):
+    ''' Writes items (sequences of values) to a CSV-file
+
+    :param path: path to the CSV-file
+    :param header: optional header row
+    :param mode: 'w' to overwrite or 'a' to append
+    :param compression: None, 'gzip' or 'zstd'
+    '''
+    def __init__(self, path, header=None, mode='w', encoding='utf-8', compression=None):
+        self.path = path
+        self.header = header
+        self.mode = mode
+        self.encoding = encoding
+        self.compression = compression
+
+    def open(self, path=None):
+        return _CsvWriter(self, path or self.path)
+
+
+class _CsvWriter(_Writer):
+    def __init__(self, sink, path):
+        self.file = open_text(path, sink.mode, compression=sink.compression, encoding=sink.encoding)
+        self._writer = csv.writer(self.file)
+        self.writerow = self._writer.writerow
+        self.writerows = self._writer.writerows
+
+        if sink.header:
+            self.writerow(sink.header)
+
+    def close(self):
+        self.file.close()
+
+
+class JsonLinesSink(Sink):
+    ''' Writes items as JSON Lines
+
+    :param path: path to the file
+    :param mode: 'w' to overwrite or 'a' to append
+    '''
+    def __init__(self, path, mode='w'):
+        self.path = path
+        self.mode = mode
+
+    def open(self, path=None):
+        return _JsonLinesWriter(self, path or self.path)
+
+
+class _JsonLinesWriter(_Writer):
+    def __init__(self, sink, path):
+        self.file = open(path, sink.mode, encoding='utf-8')
+
+    def writerows(self, rows):
+        self.file.writelines(json.dumps(row, ensure_ascii=False) + '\n' for row in rows)
+
+    def close(self):
+        self.file.close()
+
+
+class ArrowSink(Sink):
+    ''' Writes items (sequences of values) to a Parquet or Arrow IPC file with the given schema
+
+    :param path: path to the file
+    :param schema: list of (name, type) tuples, types are pyarrow types or their names ('string', 'int64', ...)
+    :param output_format: 'parquet' or 'arrow'
+    '''
+    def __init__(self, path, schema, output_format='parquet'):
+        if pa is None:
+            raise RuntimeError('pyarrow is required for Parquet & Arrow output: pip install pyarrow')
+
+        self.path = path
+        self.schema = pa.schema([
+            (name, pa.type_for_alias(type_) if isinstance(type_, str) else type_) for name, type_ in schema
+        ])
+        self.output_format = output_format
+
+    def open(self, path=None):
+        return _ArrowWriter(self, path or self.path)
+
+
+class _ArrowWriter(_Writer):
+    def __init__(self, sink, path):
+        self.schema = sink.schema
+        if sink.output_format == 'parquet':
+            self._writer = pq.ParquetWriter(path, self.schema)
+            self._write_batch = lambda batch: self._writer.write_table(pa.Table.from_batches([batch]))
+        else:
+            self._writer = pa.ipc.new_file(path, self.schema)
+            self._write_batch = self._writer.write_batch
+
+    def writerow(self, row):
+        self.writerows([row])
+
+    def writerows(self, rows):
+        columns = list(zip(*rows))
+        if not columns:
+            return
+
+        self.write_columns([pa.array(column, type=field.type) for column, field in zip(columns, self.schema)])
+
+    def write_columns(self, arrays):
+        ''' Writes pyarrow arrays as the columns of the schema, without converting them to rows '''
+        self._write_batch(pa.RecordBatch.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        self._writer.close()
+
+
+class Pipeline:
+    ''' Declarative lazy pipeline: source -> filter/map stages -> sink
+
+    :param source: any iterable of items
+    '''
+    def __init__(self, source):
+        self.source = source
+        self.stages = []
+
+    def filter(self, predicate):
+        ''' Keeps only the items for which `predicate(item)` is true '''
+        self.stages.append((filter, predicate))
+        return self
+
+    def map(self, function):
+        ''' Replaces every item with `function(item)` '''
+        self.stages.append((map, function))
+        return self
+
+    def __iter__(self):
+        return apply_stages(self.stages, self.source)
+
+    def run(self, sink, workers=1, chunk_size=10_000):
+        ''' Runs the pipeline writing the results to the sink. The order of the items is preserved.
+
+        :param sink: object with `write(items)` method, returning the number of written items
+        :param workers: number of processes to run the stages in
+        :param chunk_size: number of items sent to a worker at once
+        :return: number of written items
+        '''
+        if workers > 1:
+            return sink.write(self._iter_parallel(workers, chunk_size))
+
+        return sink.write(iter(self))
+
+    def _iter_parallel(self, workers, chunk_size):
+        source = iter(self.source)
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(self.stages,)) as executor:
+            # Keep a bounded number of chunks in flight, so the source isn't read ahead of the sink
+            pending = deque()
+            while True:
+                while len(pending) < workers * 2:
+                    chunk = list(islice(source, chunk_size))
+                    if not chunk:
+                        break
+                    pending.append(executor.submit(_run_chunk, chunk))
+
+                if not pending:
+                    return
+
+                yield from pending.popleft().result()
+
+
+def apply_stages(stages, items):
+    ''' Chains the stages over the items lazily '''
+    items = iter(items)
+    for stage, function in stages:
+        items = stage(function, items)
+    return items
+
+
+# Stages of the pipeline run by the worker process, set once by `_init_worker`
+_worker_stages = []
+
+
+def _init_worker(stages):
+    global _worker_stages
+    _worker_stages = stages
+
+
+def _run_chunk(chunk):
+    return list(apply_stages(_worker_stages, chunk))
@@ -0,0 +1,313 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Mock MIIIX.org
+~~~~~~~~~~~~~~
+
+Local mock of the MIIIX.org endpoints used by `tyres-n-rims.py` (and an FTP-server to upload to),
+so the parser can be run and checked without the real website:
+    POST /login                  - sets the session cookie
+    POST /storage/export/do      - generates the export, or submits an export job if `async_job` is set
+    GET  /storage/export/status  - status of an export job
+    GET  /files/<name>           - generated files, Range requests are supported
+
+Behaviour of the server can be changed on the fly with `MockMIIIX.settings`:
+    delays      - time to generate the export of each category (by its id), in seconds
+    fail        - ids of the categories whose exports fail with HTTP 500
+    drop_after  - the next download is cut off after that many bytes
+    no_range    - Range headers are ignored
+    flaky       - number of the next status requests to answer with 503 and Retry-After
+    garbled     - number of the next status requests to answer with 200 and a malformed body
+
+
+How to Run:
+    $ {path_to_python} mock_server.py
+
+    Starts the mock servers and runs the parser against them. The FTP-server requires pyftpdlib:
+        $ pip install pyftpdlib
+'''
+
+import os, time, hashlib, json
+import importlib.util, logging, socket, tempfile, threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+try:
+    from pyftpdlib.authorizers import DummyAuthorizer
+    from pyftpdlib.handlers import FTPHandler
+    from pyftpdlib.servers import ThreadedFTPServer
+except ImportError:
+    ThreadedFTPServer = None
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, status, body, content_type='application/json', headers=None):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except ConnectionError:
+            # The client has given up waiting, e.g. timed out
+            pass
+
+    def do_POST(self):
+        mock = self.server.mock
+        length = int(self.headers.get('Content-Length') or 0)
+        form = {name: values[0] for name, values in parse_qs(self.rfile.read(length).decode()).items()}
+        mock.requests.append(('POST', self.path, form))
+
+        if self.path == '/login':
+            return self.send(200, b'OK', 'text/html', {'Set-Cookie': '{}={}; Path=/'.format(*mock.COOKIE)})
+
+        if self.path == '/storage/export/do':
+            if '='.join(mock.COOKIE) not in (self.headers.get('Cookie') or ''):
+                return self.send(403, {'err': 'Not logged in'})
+
+            category = form.get('storage_category_id')
+            if category not in mock.FILES:
+                return self.send(400, {'err': 'Unknown category'})
+
+            if form.get('async_job'):
+                job_id = mock.submit_job(category)
+                return self.send(200, {'err': False, 'obj': {'id': job_id}})
+
+            time.sleep(mock.settings['delays'].get(category, 0))
+            if category in mock.settings['fail']:
+                return self.send(500, b'<html>Internal Server Error</html>', 'text/html')
+            return self.send(200, {'err': False, 'obj': mock.export_info(category)})
+
+        self.send(404, {'err': 'Not found'})
+
+    def do_GET(self):
+        mock = self.server.mock
+        url = urlsplit(self.path)
+        mock.requests.append(('GET', self.path, self.headers.get('Range')))
+
+        if url.path == '/storage/export/status':
+            job_id = parse_qs(url.query).get('id', [None])[0]
+            if job_id not in mock.jobs:
+                return self.send(404, {'err': 'Job not found'})
+
+            if mock.settings['flaky']:
+                mock.settings['flaky'] -= 1
+                return self.send(503, b'Service Unavailable', 'text/plain', {'Retry-After': '0'})
+
+            if mock.settings['garbled']:
+                mock.settings['garbled'] -= 1
+                # Alternately an HTML page and a JSON object without `obj`
+                return self.send(200, b'<html>Maintenance</html>', 'text/html') if mock.settings['garbled'] % 2 else self.send(200, {'err': False})
+
+            category, submitted_at = mock.jobs[job_id]
+            if time.time() - submitted_at < mock.settings['delays'].get(category, 0):
+                return self.send(200, {'err': False, 'obj': {'id': job_id, 'status': 'pending'}})
+            if category in mock.settings['fail']:
+                return self.send(200, {'err': 'Export failed', 'obj': {'id': job_id}})
+            return self.send(200, {'err': False, 'obj': mock.export_info(category)})
+
+        if url.path.startswith('/files/'):
+            return self.send_file(url.path.rsplit('/', 1)[1])
+
+        self.send(404, {'err': 'Not found'})
+
+    def send_file(self, name):
+        mock = self.server.mock
+        data = next((data for file_name, data in mock.FILES.values() if file_name == name), None)
+        if data is None:
+            return self.send(404, {'err': 'Not found'})
+
+        range_header = None if mock.settings['no_range'] else self.headers.get('Range')
+        start = int(range_header.split('=')[1].split('-')[0]) if range_header else 0
+        if start >= len(data) > 0:
+            return self.send(416, b'', 'application/octet-stream', {'Content-Range': 'bytes */{}'.format(len(data))})
+
+        self.send_response(206 if range_header else 200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(data) - start))
+        if range_header:
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, len(data) - 1, len(data)))
+        self.end_headers()
+
+        drop_after, mock.settings['drop_after'] = mock.settings['drop_after'], None
+        if drop_after:
+            # Emulate a dropped connection in the middle of the download
+            self.wfile.write(data[start:start + drop_after])
+            self.wfile.flush()
+            self.close_connection = True
+            self.connection.shutdown(socket.SHUT_RDWR)
+            return
+
+        self.wfile.write(data[start:])
+
+
+class MockMIIIX:
+    COOKIE = ('PHPSESSID', 'mock-session')
+    CREATED_AT = '2018-12-01 10:00:00'
+
+    def __init__(self, host='127.0.0.1', port=0, files=None):
+        '''
+        :param files: category id -> (file name, content). Random content of 3MB tyres and 300KB rims by default
+        '''
+        self.FILES = files or {
+            '1': ('tyres.xls', os.urandom(3 * 1024 * 1024 + 17)),
+            '2': ('rims.xls', os.urandom(300 * 1024)),
+        }
+        self.settings = {'delays': {}, 'fail': set(), 'drop_after': None, 'no_range': False, 'flaky': 0, 'garbled': 0}
+        self.jobs = {}
+        self.requests = []
+        self.server = ThreadingHTTPServer((host, port), MockHandler)
+        self.server.mock = self
+        self.url = 'http://{}:{}'.format(*self.server.server_address)
+
+    def submit_job(self, category):
+        job_id = '{}-{}'.format(category, len(self.jobs) + 1)
+        self.jobs[job_id] = (category, time.time())
+        return job_id
+
+    def export_info(self, category):
+        name, data = self.FILES[category]
+        return {'file': '/files/' + name, 'created_at': self.CREATED_AT, 'size': len(data), 'md5': hashlib.md5(data).hexdigest()}
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class MockFTP:
+    def __init__(self, host='127.0.0.1', port=0, user='user', passwd='passwd'):
+        if ThreadedFTPServer is None:
+            raise RuntimeError('pyftpdlib is required for the mock FTP-server: pip install pyftpdlib')
+
+        self.root = tempfile.mkdtemp(prefix='mock-ftp-')
+        self.upload_dir = 'upload'
+        os.mkdir(os.path.join(self.root, self.upload_dir))
+
+        authorizer = DummyAuthorizer()
+        authorizer.add_user(user, passwd, self.root, perm='elradfmwMT')
+        handler = type('MockFTPHandler', (FTPHandler,), {'authorizer': authorizer})
+        # pyftpdlib configures verbose logging of its own unless the logger has handlers
+        logging.getLogger('pyftpdlib').addHandler(logging.NullHandler())
+
+        self.server = ThreadedFTPServer((host, port), handler)
+        self.settings = {'host': host, 'port': self.server.address[1], 'user': user, 'passwd': passwd}
+
+    def uploaded(self, name):
+        with open(os.path.join(self.root, self.upload_dir, name), 'rb') as f:
+            return f.read()
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.close_all()
+
+
+def load_parser():
+    ''' Imports `tyres-n-rims.py`, which can't be imported by its name '''
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tyres-n-rims.py')
+    spec = importlib.util.spec_from_file_location('tyres_n_rims', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def main():
+    mix = load_parser()
+    mock = MockMIIIX().start()
+    mock.settings['delays'] = {'1': 1.0, '2': 0.5}
+
+    def downloaded(parser):
+        return {name.split('_', 1)[1]: open(os.path.join(parser.downloads, name), 'rb').read()
+                for name in os.listdir(parser.downloads) if name.endswith('.xls')}
+
+    expected = dict(mock.FILES.values())
+
+    # Concurrent exports: the total time is about the time of the slowest one
+    parser = mix.MIIIX_Parser(url=mock.url, downloads=tempfile.mkdtemp())
+    started = time.time()
+    parser.run()
+    print('Exports: {} in {:.1f}s'.format(parser.export_statuses, time.time() - started))
+    assert downloaded(parser) == expected
+
+    # Export jobs, polled through the failing and malformed status requests
+    mock.settings['flaky'] = 2
+    mock.settings['garbled'] = 2
+    parser = mix.MIIIX_Parser(url=mock.url, downloads=tempfile.mkdtemp(), use_jobs=True)
+    parser.JOB_POLL_INTERVAL = 0.2
+    parser.run()
+    print('Jobs: {}'.format(parser.export_statuses))
+    assert downloaded(parser) == expected
+
+    # Dropped connection: the download is resumed with a Range request
+    mock.settings['drop_after'] = 100 * 1024
+    parser = mix.MIIIX_Parser(url=mock.url, downloads=tempfile.mkdtemp())
+    parser.CHUNK_SIZE = 64 * 1024
+    parser.run()
+    resumed = [request for request in mock.requests if request[0] == 'GET' and request[2]]
+    print('Resumed downloads: {}'.format(resumed))
+    assert downloaded(parser) == expected and resumed
+
+    # A failed category doesn't stop the other one, but fails the run
+    mock.settings['fail'] = {'2'}
+    parser = mix.MIIIX_Parser(url=mock.url, downloads=tempfile.mkdtemp())
+    try:
+        parser.run()
+    except SystemExit:
+        pass
+    print('Failed export: {}'.format(parser.export_statuses))
+    assert parser.export_statuses['tyres'] == 'OK' and parser.export_statuses['rims'] != 'OK'
+    mock.settings['fail'] = set()
+
+    # `timeout` applies to all the categories not listed in `export_timeouts`
+    parser = mix.MIIIX_Parser(url=mock.url, downloads=tempfile.mkdtemp(), timeout=0.2, export_timeouts={'rims': 5})
+    try:
+        parser.run()
+    except SystemExit:
+        pass
+    print('Timed out export: {}'.format(parser.export_statuses))
+    assert parser.export_statuses['tyres'] != 'OK' and parser.export_statuses['rims'] == 'OK'
+
+    # Files are uploaded to the FTP-server while they are downloaded. Files downloaded by a run
+    # which failed to upload them are uploaded by the next one, even though they aren't downloaded again
+    if ThreadedFTPServer is not None:
+        ftp = MockFTP().start()
+        downloads = tempfile.mkdtemp()
+        for passwd in ('wrong', ftp.settings['passwd']):
+            parser = mix.MIIIX_Parser(url=mock.url, downloads=downloads, ftp_enabled=True)
+            parser.ftp_settings = dict(ftp.settings, passwd=passwd)
+            parser.ftp_settings_upload_dir = ftp.upload_dir
+            try:
+                parser.run()
+            except SystemExit:
+                pass
+        names = [name for name in os.listdir(downloads) if name.endswith('.xls')]
+        print('FTP uploads: {}'.format(names))
+        assert parser.export_statuses == {'tyres': 'OK', 'rims': 'OK'}
+        assert all(ftp.uploaded(name) == expected[name.split('_', 1)[1]] for name in names)
+        ftp.stop()
+    else:
+        print('pyftpdlib is not installed. Skipping FTP uploads...')
+
+    mock.stop()
+    print('All checks passed!')
+
+
+if __name__ == '__main__':
+    main()
@@ -14,12 +14,16 @@ MIX Parser
 
 The script connects to the MIIIX.org website and:
 1. Authenticates with given credentials.
-2. Initiates generation of a file from one of the the two given categories.
+2. Initiates generation of files from the two given categories concurrently.
    The categories are: Tyres, Rims.
-3. Waits until generation is finished.
+3. Waits until generation is finished. A failed category doesn't stop the others.
+   With `use_jobs`, exports are submitted as jobs and polled instead, and a restarted script
+   reattaches to the jobs in flight.
 4. Downloads generated file and saves it at the given path.
-5. Optionally uploads downloaded files to a client's FTP-server.
+5. Optionally uploads downloaded files to a client's FTP-server, while they are being downloaded.
 6. Logs all its actions to the system's stdin and log-file.
+7. Optionally writes timings of every stage, transferred bytes and request latencies
+   to a Prometheus textfile (*.prom) or as JSON lines (any other extension).
 
 
 How to Run:
@@ -59,11 +63,314 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 '''
 
-import os, sys
+import os, sys, time, hashlib
+import asyncio, functools
 import requests, json
 from datetime import datetime
 import logging, logging.handlers
-from ftplib import FTP
+import queue, threading
+from contextlib import contextmanager
+from ftplib import FTP, all_errors as ftp_errors, error_perm
+from concurrent.futures import ThreadPoolExecutor
+
+
+class MIIIX_Error(Exception):
+    pass
+
+
+class FTPUploader():
+    '''
+    Uploads files to an FTP-server over a pool of connections, which are reused across uploads.
+    Files are stored under a temporary name and renamed when complete, so partial files are never seen by clients.
+    '''
+    def __init__(self, host, user, passwd, upload_dir, port=21, block_size=256 * 1024, pool_size=1, queue_size=16, timeout=60):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.passwd = passwd
+        self.upload_dir = upload_dir
+        self.block_size = block_size
+        self.queue_size = queue_size
+        self.timeout = timeout
+
+        # Idle connections. No more than pool_size connections are open at once
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(pool_size)
+
+
+    @contextmanager
+    def connection(self):
+        with self._slots:
+            ftp = None
+            while ftp is None and not self._idle.empty():
+                ftp = self._idle.get()
+                try:
+                    ftp.voidcmd('NOOP')
+                except ftp_errors:
+                    ftp.close()
+                    ftp = None
+
+            if ftp is None:
+                ftp = FTP(timeout=self.timeout)
+                ftp.connect(self.host, self.port)
+                ftp.login(self.user, self.passwd)
+                if self.upload_dir:
+                    ftp.cwd(self.upload_dir)
+
+            try:
+                yield ftp
+            except BaseException:
+                # The connection may be in the middle of a transfer
+                ftp.close()
+                raise
+            else:
+                self._idle.put(ftp)
+
+
+    def store(self, f, name):
+        with self.connection() as ftp:
+            temp_name = name + '.part'
+            result = ftp.storbinary('STOR {}'.format(temp_name), f, blocksize=self.block_size)
+            try:
+                ftp.rename(temp_name, name)
+            except error_perm:
+                # Some servers don't overwrite files on rename
+                ftp.delete(name)
+                ftp.rename(temp_name, name)
+
+        return result
+
+
+    def upload(self, file, name=None):
+        with open(file, 'rb') as f:
+            return self.store(f, name or os.path.basename(file))
+
+
+    def stream(self, name):
+        '''
+        Starts uploading a file, which content is written to the returned stream chunk by chunk (e.g. while it's downloaded).
+        Chunks are passed through a bounded queue, so a slow server slows down the writer instead of filling up memory.
+        '''
+        return FTPStream(self, name)
+
+
+    def close(self):
+        while not self._idle.empty():
+            ftp = self._idle.get()
+            try:
+                ftp.quit()
+            except ftp_errors:
+                ftp.close()
+
+
+class FTPStream():
+    # Queue items ending the upload
+    EOF, ABORT = object(), object()
+
+    def __init__(self, uploader, name):
+        self.name = name
+        self.size = 0
+        self.error = None
+        self.result = None
+        self.aborted = False
+        self._chunks = queue.Queue(maxsize=uploader.queue_size)
+        # The rest of the chunk, which didn't fit into the last read
+        self._pending = memoryview(b'')
+        self._thread = threading.Thread(target=self._upload, args=(uploader,), name='FTPStream', daemon=True)
+        self._thread.start()
+
+
+    def _upload(self, uploader):
+        try:
+            self.result = uploader.store(self, self.name)
+        except Exception as err:
+            self.error = err
+
+
+    def read(self, size=-1):
+        # Called by storbinary with its block size. Chunks are split, so blocks are never larger than that
+        if not self._pending:
+            chunk = self._chunks.get()
+            if chunk is self.ABORT:
+                raise MIIIX_Error('Upload of \'{}\' was aborted'.format(self.name))
+            if chunk is self.EOF:
+                return b''
+            self._pending = memoryview(chunk)
+
+        if size is None or size < 0:
+            size = len(self._pending)
+
+        # Slicing a memoryview doesn't copy the rest of the chunk
+        block, self._pending = self._pending[:size].tobytes(), self._pending[size:]
+
+        return block
+
+
+    def _put(self, item):
+        while self._thread.is_alive():
+            try:
+                return self._chunks.put(item, timeout=1)
+            except queue.Full:
+                pass
+
+
+    def write(self, chunk):
+        # Errors are raised by close(), so a failed upload doesn't interrupt the writer
+        if self.error or self.aborted:
+            return
+
+        self._put(chunk)
+        self.size += len(chunk)
+
+
+    def close(self):
+        ''' Waits for the upload to finish '''
+        self._put(self.EOF)
+        self._thread.join()
+        if self.error:
+            raise MIIIX_Error('FTP upload of \'{}\' failed: {}'.format(self.name, self.error))
+
+        return self.result
+
+
+    def abort(self):
+        ''' Stops the upload, leaving the file on the server as it was '''
+        self.aborted = True
+        self._put(self.ABORT)
+        self._thread.join()
+
+
+class Metrics():
+    '''
+    Stage timers, byte counters and request latency histograms of a run.
+
+    Written at the end of the run to a Prometheus textfile (for the textfile collector of node_exporter)
+    if the file name ends with '.prom', or appended to it as JSON lines (one line per stage and a summary) otherwise.
+    '''
+    BUCKETS = (0.1, 0.5, 1, 5, 15, 60, 300, 900, 1800, 3600)
+
+    def __init__(self, prefix='miiix'):
+        self.prefix = prefix
+        self.started = time.time()
+        self.stages = []
+        self._gauges = {}
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((label, str(value)) for label, value in labels.items() if value is not None))
+
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._gauges[self._key(name, labels)] = value
+
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            # Counts per bucket, then sum and count of all the values
+            histogram = self._histograms.setdefault(key, [0] * (len(self.BUCKETS) + 2))
+            for position, bucket in enumerate(self.BUCKETS):
+                if value <= bucket:
+                    histogram[position] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+
+    def record(self, stage, duration, size=None, status='ok', **labels):
+        self.set('stage_duration_seconds', duration, stage=stage, **labels)
+        self.inc('stage_runs_total', stage=stage, status=status, **labels)
+        if size is not None:
+            self.inc('transferred_bytes_total', size, stage=stage, **labels)
+            self.set('stage_bytes_per_second', size / duration if duration else 0, stage=stage, **labels)
+
+        with self._lock:
+            self.stages.append(dict(labels, stage=stage, status=status, duration=round(duration, 3), bytes=size))
+
+
+    @contextmanager
+    def timer(self, stage, **labels):
+        '''
+        Times the stage. The bytes it transfers can be set as `size` of the yielded dict.
+        '''
+        started = time.time()
+        stats = {'size': None}
+        try:
+            yield stats
+        except BaseException:
+            self.record(stage, time.time() - started, stats['size'], status='error', **labels)
+            raise
+        else:
+            self.record(stage, time.time() - started, stats['size'], **labels)
+
+
+    def prometheus(self):
+        def line(name, labels, value):
+            labels = ','.join('{}="{}"'.format(label, value.replace('"', '\\"')) for label, value in labels)
+            return '{}_{}{} {}'.format(self.prefix, name, '{' + labels + '}' if labels else '', value)
+
+        lines = []
+        with self._lock:
+            for kind, metrics in (('gauge', self._gauges), ('counter', self._counters)):
+                for name in sorted({name for name, _ in metrics}):
+                    lines.append('# TYPE {}_{} {}'.format(self.prefix, name, kind))
+                    lines.extend(line(name, labels, value) for (metric, labels), value in sorted(metrics.items()) if metric == name)
+
+            for name in sorted({name for name, _ in self._histograms}):
+                lines.append('# TYPE {}_{} histogram'.format(self.prefix, name))
+                for (metric, labels), histogram in sorted(self._histograms.items()):
+                    if metric != name:
+                        continue
+                    for bucket, count in zip(self.BUCKETS + ('+Inf',), histogram[:-2] + [histogram[-1]]):
+                        lines.append(line(name + '_bucket', labels + (('le', str(bucket)),), count))
+                    lines.append(line(name + '_sum', labels, histogram[-2]))
+                    lines.append(line(name + '_count', labels, histogram[-1]))
+
+        lines.append('# TYPE {}_last_run_timestamp_seconds gauge'.format(self.prefix))
+        lines.append(line('last_run_timestamp_seconds', (), int(self.started)))
+
+        return '\n'.join(lines) + '\n'
+
+
+    def json_lines(self):
+        started = datetime.fromtimestamp(self.started).isoformat()
+        with self._lock:
+            summary = {
+                'run': started,
+                'duration': round(time.time() - self.started, 3),
+                'counters': {self._name(key): value for key, value in self._counters.items()},
+                'histograms': {self._name(key): dict(zip(self.BUCKETS + ('sum', 'count'), histogram)) for key, histogram in self._histograms.items()},
+            }
+            lines = [json.dumps(dict(stage, run=started)) for stage in self.stages]
+
+        return '\n'.join(lines + [json.dumps(summary)]) + '\n'
+
+
+    @staticmethod
+    def _name(key):
+        name, labels = key
+        return name + ''.join('[{}={}]'.format(label, value) for label, value in labels)
+
+
+    def write(self, file):
+        if file.endswith('.prom'):
+            # Replaced atomically, so the collector never reads a partial file
+            with open(file + '.tmp', 'w') as f:
+                f.write(self.prometheus())
+            os.replace(file + '.tmp', file)
+        else:
+            with open(file, 'a') as f:
+                f.write(self.json_lines())
 
 
 class MIIIX_Parser():
@@ -76,24 +383,67 @@ class MIIIX_Parser():
 
     # Set timeout
     TIMEOUT = 3600 # 1h
+    # Per-category timeouts, e.g. {'rims': 600}. Categories not listed here use TIMEOUT (or `timeout`)
+    EXPORT_TIMEOUTS = {}
+
+    # Job-oriented exports: an export is submitted with a short timeout and its status is polled,
+    # starting every JOB_POLL_INTERVAL seconds and backing off up to JOB_POLL_MAX_INTERVAL.
+    # Jobs are kept on disk, so they are reattached to after a restart instead of being resubmitted
+    USE_JOBS = False
+    # Form fields which turn an export request into a job submission
+    JOB_SUBMIT_PARAMS = {'async_job': 1}
+    # Field of the job id in the response `obj`, and the query parameter of the status request it's sent as
+    JOB_ID_FIELD = 'id'
+    JOB_STATUS_PARAM = 'id'
+    JOB_SUBMIT_TIMEOUT = 60
+    JOB_POLL_INTERVAL = 5
+    JOB_POLL_MAX_INTERVAL = 120
+    JOB_POLL_BACKOFF = 1.5
+
+    # Downloads are streamed in chunks and resumed up to DOWNLOAD_RETRIES times if interrupted
+    CHUNK_SIZE = 1024 * 1024 # 1MB
+    DOWNLOAD_RETRIES = 3
+
+    # FTP uploads. FTP_BLOCK_SIZE is the size of the blocks sent by storbinary
+    FTP_ENABLED = False
+    FTP_BLOCK_SIZE = 256 * 1024
 
     # Paths
     DOWNLOADS = '/var/www/www-root/data/www/baza-koles.ru/MIIIX/'
     LOG_FILE = os.path.join(DOWNLOADS, 'tyres-n-rims.log')
+    # Metrics of the runs, e.g. os.path.join(DOWNLOADS, 'tyres-n-rims.prom'). Not written if None
+    METRICS_FILE = None
 
     HEADERS = {
         'User-Agent': 'Mozilla/5.0 (Windows NT 6.1; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/70.0.3538.110 Safari/537.36',
     }
+    API_HEADERS = {
+        'Accept': 'application/json, text/javascript, */*; q=0.01',
+        'Content-Type': 'application/x-www-form-urlencoded; charset=UTF-8',
+        'X-Requested-With': 'XMLHttpRequest',
+    }
     ### SETTINGS: END
 
-    def __init__(self, url=MIIIX_ORG, login=USER_LOGIN, password=USER_PASSWORD, timeout=TIMEOUT):
+    def __init__(self, url=MIIIX_ORG, login=USER_LOGIN, password=USER_PASSWORD, timeout=TIMEOUT,
+                 export_timeouts=None, downloads=DOWNLOADS, max_workers=None,
+                 ftp_enabled=FTP_ENABLED, ftp_block_size=FTP_BLOCK_SIZE, use_jobs=USE_JOBS, metrics_file=METRICS_FILE):
         self.url = url
         self.login = login
         self.password = password
         self.login_url = self.url + '/login'
         self.protected_url = self.url + '/storage/export'
         self.api_url = self.protected_url + '/do'
+        self.job_status_url = self.protected_url + '/status'
         self.timeout = timeout
+        self.export_timeouts = self.EXPORT_TIMEOUTS if export_timeouts is None else export_timeouts
+        self.downloads = downloads
+        self.log_file = os.path.join(downloads, 'tyres-n-rims.log')
+        # Number of concurrent exports. All the categories at once by default
+        self.max_workers = max_workers
+        self.use_jobs = use_jobs
+        self.jobs_dir = os.path.join(downloads, 'jobs')
+        self.metrics_file = metrics_file
+        self.metrics = Metrics()
 
         # tyres@id = 1 (processed up to 30 mins, 15MB)
         # rims@id =2 (processed around 30 sec, 1.5MB)
@@ -111,87 +461,405 @@ class MIIIX_Parser():
         #    To be filled in if needed!
         self.ftp_settings = {
             'host': '_NA_',
+            'port': 21,
             'user': '_NA_',
             'passwd': '_NA_',
         }
         self.ftp_settings_upload_dir = '_NA_'
+        self.ftp_enabled = ftp_enabled
+        self.ftp_block_size = ftp_block_size
+        # Created on the first upload and shared by all the categories
+        self.ftp_uploader = None
+        self.ftp_lock = threading.Lock()
+
+        # Category -> 'OK' or the error the export failed with
+        self.export_statuses = {}
 
 
     def run(self):
         # Init Logger
-        self.init_logger(logfile=self.LOG_FILE, level=logging.INFO, console_enabled=True)
+        self.init_logger(logfile=self.log_file, level=logging.INFO, console_enabled=True)
 
         self.logger.info('Script started...')
-        # Ensure the session context is closed after use
-        with requests.Session() as session:
-            self.logger.info('Trying to authenticate...')
-
-            response = self.send_request(session.post, self.login_url, headers=self.HEADERS, data=self.login_payload, disable_log=True)
-            if response.ok:
-                self.logger.info('Successfully authenticated and logged in!')
-                # Export all the export categories
-                for category_id in self.export_categories.values():
-                    payload = self.set_export_payload(category_id)
-                    # Generate & download files
-                    self.run_export(session, payload)
+        try:
+            # Ensure the session context is closed after use
+            with requests.Session() as session:
+                self.logger.info('Trying to authenticate...')
+
+                try:
+                    with self.metrics.timer('login'):
+                        response = self.send_request(session.post, self.login_url, headers=self.HEADERS, data=self.login_payload, disable_log=True)
+                except MIIIX_Error as err:
+                    self.die(err)
+
+                if response.ok:
+                    self.logger.info('Successfully authenticated and logged in!')
+                    # Generate & download files of all the export categories
+                    if self.use_jobs:
+                        self.run_jobs(session)
+                    else:
+                        self.run_exports(session)
+                else:
+                    self.die("Can't login. Status code: {}".format(response.status_code))
+
+            if self.ftp_uploader:
+                self.ftp_uploader.close()
+
+            failed = {category: status for category, status in self.export_statuses.items() if status != 'OK'}
+            if failed:
+                self.die('Some exports failed: {}'.format(failed))
+
+            self.logger.info('Script finished successfully!')
+        finally:
+            # Failed runs are recorded too
+            if self.metrics_file:
+                self.metrics.write(self.metrics_file)
+
+
+    def run_exports(self, session, categories=None):
+        '''
+        Runs the exports of the categories concurrently, so the total time is about the time of the slowest one.
+        Statuses of the exports are stored in `export_statuses`.
+        '''
+        categories = categories or list(self.export_categories)
+        self.logger.info('Starting exports: {}...'.format(', '.join(categories)))
+
+        with ThreadPoolExecutor(max_workers=self.max_workers or len(categories)) as executor:
+            statuses = executor.map(lambda category: self.run_category_export(session, category), categories)
+            self.export_statuses.update(zip(categories, statuses))
+
+        return self.export_statuses
+
+
+    def run_category_export(self, session, category):
+        '''
+        Exports one category in its own session with the cookies of the authenticated one (sessions aren't thread-safe),
+        with its own timeout. Errors are logged and returned as the status, so they don't stop the other exports.
+        '''
+        started = time.time()
+        try:
+            with requests.Session() as export_session, self.metrics.timer('export', category=category):
+                export_session.cookies.update(session.cookies)
+                payload = self.set_export_payload(self.export_categories[category])
+                self.run_export(export_session, payload, timeout=self.export_timeouts.get(category, self.timeout), category=category)
+        except Exception as err:
+            self.logger.error('Export of \'{}\' failed after {:.1f}s: {}'.format(category, time.time() - started, err))
+            return str(err) or err.__class__.__name__
+
+        self.logger.info('Export of \'{}\' finished in {:.1f}s.'.format(category, time.time() - started))
+        return 'OK'
+
+
+    def run_jobs(self, session, exports=None):
+        '''
+        Runs the exports as jobs from one event loop: `exports` are (category, department) pairs,
+        all the categories of the department 1 by default. Statuses of the jobs are stored in `export_statuses`.
+        '''
+        exports = exports or [(category, 1) for category in self.export_categories]
+        self.logger.info('Starting export jobs: {}...'.format(', '.join(self.job_key(*export) for export in exports)))
+
+        async def run_all():
+            return await asyncio.gather(*(self.run_job(session, category, department) for category, department in exports))
+
+        statuses = asyncio.run(run_all())
+        self.export_statuses.update(zip((self.job_key(*export) for export in exports), statuses))
+
+        return self.export_statuses
+
+
+    async def run_job(self, session, category, department=1):
+        '''
+        Submits an export job (or reattaches to the one submitted before), polls it until the file is generated
+        and downloads the file. HTTP requests are run in threads, so only the waits are done in the event loop.
+        '''
+        loop = asyncio.get_running_loop()
+        key = self.job_key(category, department)
+        started = time.time()
+        try:
+            with requests.Session() as job_session, self.metrics.timer('export', category=key):
+                job_session.cookies.update(session.cookies)
+
+                job = self.load_job(key)
+                if job:
+                    self.logger.info('Reattaching to export job \'{}\' submitted at {}...'.format(key, datetime.fromtimestamp(job['submitted_at'])))
+                else:
+                    payload = self.set_export_payload(self.export_categories[category], department)
+                    json = await loop.run_in_executor(None, self.submit_job, job_session, payload)
+                    job = {'id': json['obj'].get(self.JOB_ID_FIELD), 'submitted_at': time.time(), 'payload': payload}
+                    # The server may return the file right away
+                    if json['obj'].get('file'):
+                        job['result'] = json
+                    self.save_job(key, job)
+
+                if 'result' not in job:
+                    # Counted from the submission, whenever it was
+                    job['result'] = await self.poll_job(job_session, key, job, timeout=self.export_timeouts.get(category, self.timeout))
+                    self.metrics.record('generate', time.time() - job['submitted_at'], category=key)
+                    self.save_job(key, job)
+
+                await loop.run_in_executor(None, self.save_file_from_json, job['result'], job_session, key)
+                self.remove_job(key)
+        except Exception as err:
+            self.logger.error('Export job \'{}\' failed after {:.1f}s: {}'.format(key, time.time() - started, err))
+            return str(err) or err.__class__.__name__
+
+        self.logger.info('Export job \'{}\' finished in {:.1f}s.'.format(key, time.time() - started))
+        return 'OK'
+
+
+    def submit_job(self, session, api_payload):
+        api_headers = dict(self.HEADERS, **self.API_HEADERS)
+        api_response = self.send_request(session.post, self.api_url, headers=api_headers, data=dict(api_payload, **self.JOB_SUBMIT_PARAMS), timeout=self.JOB_SUBMIT_TIMEOUT)
+        try:
+            json = api_response.json()
+        except ValueError:
+            raise MIIIX_Error('No JSON object could be decoded. Status code: {}'.format(api_response.status_code))
+
+        obj = json.get('obj') if isinstance(json, dict) else None
+        if not api_response.ok or not isinstance(obj, dict) or json.get('err') != False or not (obj.get(self.JOB_ID_FIELD) or obj.get('file')):
+            raise MIIIX_Error('Failed to submit export job! Status code: {}'.format(api_response.status_code))
+
+        return json
+
+
+    async def poll_job(self, session, key, job, timeout):
+        '''
+        Polls the job until the file is generated, backing off from JOB_POLL_INTERVAL to JOB_POLL_MAX_INTERVAL
+        (or waiting as long as the server asks with Retry-After). Network errors and malformed replies don't fail the job,
+        only the timeout does.
+        '''
+        loop = asyncio.get_running_loop()
+        api_headers = dict(self.HEADERS, **self.API_HEADERS)
+        request = functools.partial(self.send_request, session.get, self.job_status_url, headers=api_headers,
+                                    params={self.JOB_STATUS_PARAM: job['id']}, timeout=self.JOB_SUBMIT_TIMEOUT)
+        interval = self.JOB_POLL_INTERVAL
+        while True:
+            delay = interval
+            try:
+                response = await loop.run_in_executor(None, request)
+            except MIIIX_Error as err:
+                self.logger.warning('Polling of export job \'{}\' failed: {}. Retrying...'.format(key, err))
             else:
-                self.die("Can't login. Status code: {}".format(response.status_code))
+                if response.status_code == 404:
+                    self.remove_job(key)
+                    raise MIIIX_Error('Export job \'{}\' is not found on the server'.format(key))
 
-        self.logger.info('Script finished successfully!')
+                if response.ok:
+                    try:
+                        json = response.json()
+                    except ValueError:
+                        json = None
 
+                    if not isinstance(json, dict):
+                        self.logger.warning('Status of export job \'{}\' is not a JSON object. Retrying...'.format(key))
+                    elif json.get('err') != False:
+                        self.remove_job(key)
+                        raise MIIIX_Error('Export job \'{}\' failed: {}'.format(key, json.get('err')))
+                    elif isinstance(json.get('obj'), dict) and json['obj'].get('file'):
+                        self.logger.info('Export job \'{}\' is done. File generated successfully!'.format(key))
+                        return json
 
-    def run_export(self, session, api_payload):
-        api_specific_headers = {
-            'Accept': 'application/json, text/javascript, */*; q=0.01',
-            'Content-Type': 'application/x-www-form-urlencoded; charset=UTF-8',
-            'X-Requested-With': 'XMLHttpRequest',
-        }
+                retry_after = response.headers.get('Retry-After', '')
+                if retry_after.isdigit():
+                    delay = int(retry_after)
+
+            elapsed = time.time() - job['submitted_at']
+            if elapsed >= timeout:
+                self.remove_job(key)
+                raise MIIIX_Error('Export job \'{}\' timed out after {:.0f}s'.format(key, elapsed))
+
+            await asyncio.sleep(min(delay, timeout - elapsed))
+            interval = min(interval * self.JOB_POLL_BACKOFF, self.JOB_POLL_MAX_INTERVAL)
 
+
+    def job_key(self, category, department=1):
+        return category if department == 1 else '{}-{}'.format(category, department)
+
+
+    def load_job(self, key):
+        try:
+            with open(os.path.join(self.jobs_dir, key + '.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+
+    def save_job(self, key, job):
+        # Written atomically, so a killed script never leaves a broken state file
+        os.makedirs(self.jobs_dir, exist_ok=True)
+        job_file = os.path.join(self.jobs_dir, key + '.json')
+        with open(job_file + '.tmp', 'w') as f:
+            json.dump(job, f)
+        os.replace(job_file + '.tmp', job_file)
+
+
+    def remove_job(self, key):
+        try:
+            os.remove(os.path.join(self.jobs_dir, key + '.json'))
+        except FileNotFoundError:
+            pass
+
+
+    def run_export(self, session, api_payload, timeout=None, category=None):
         # Extend headers with API-specific ones
-        api_headers = dict(self.HEADERS, **api_specific_headers)
+        api_headers = dict(self.HEADERS, **self.API_HEADERS)
 
         self.logger.info('Sending API-request... It will take some time (up to 30 mins) to get a response.')
-        api_response = self.send_request(session.post, self.api_url, headers=api_headers, data=api_payload, timeout=self.timeout)
+        with self.metrics.timer('generate', category=category):
+            api_response = self.send_request(session.post, self.api_url, headers=api_headers, data=api_payload, timeout=timeout or self.timeout)
         try:
             json = api_response.json()
         except ValueError:
-            self.die('No JSON object could be decoded. Status code: {}'.format(api_response.status_code))
+            raise MIIIX_Error('No JSON object could be decoded. Status code: {}'.format(api_response.status_code))
 
         if api_response.ok and json['err'] == False:
             self.logger.info('Valid API-response recieved. File generated successfully!')
             # Download generated file
-            self.save_file_from_json(json, session)
+            self.save_file_from_json(json, session, category)
         else:
-            self.die('Failed to POST data! Status code: {}'.format(api_response.status_code))
+            raise MIIIX_Error('Failed to POST data! Status code: {}'.format(api_response.status_code))
 
 
-    def save_file_from_json(self, json, session):
+    def save_file_from_json(self, json, session, category=None):
         remote_file = json['obj']['file']
         file_url = self.url + remote_file
         file_remote_name = remote_file.split('/')[-1]
         file_created_at = datetime.strptime(json['obj']['created_at'], '%Y-%m-%d %H:%M:%S')
         file_prefix = file_created_at.strftime('%Y%m%dT%H%M%S_')
-        file_name = self.DOWNLOADS + file_prefix + file_remote_name
+        file_name = os.path.join(self.downloads, file_prefix + file_remote_name)
+
+        # The file name is made of the remote name and its creation time, so the same file is never downloaded twice
+        file_size = json['obj'].get('size')
+        if os.path.isfile(file_name) and (file_size is None or os.path.getsize(file_name) == int(file_size)):
+            self.logger.info('File \'{}\' created at {} is already downloaded as \'{}\'. Skipping...'.format(file_remote_name, file_created_at, file_name))
+            # The upload may have failed after the download (e.g. on the previous run)
+            if self.ftp_enabled and not self.is_uploaded(file_name):
+                self.logger.info('File \'{}\' wasn\'t uploaded yet. Uploading...'.format(file_name))
+                self.ftp_upload(file_name, category=category)
+                self.mark_uploaded(file_name)
+            return file_name
 
         self.logger.info('Downloading \'{}\' from \'{}\'...'.format(file_remote_name, file_url))
 
-        response = self.send_request(session.get, file_url)
-        if response.ok:
-            with open(file_name, 'wb') as f:
-                result = f.write(response.content)
+        # Upload the file to FTP-server while it's downloaded. Won't be run if ftp_enabled=False
+        upload_started = time.time()
+        stream = self.get_ftp_uploader().stream(os.path.basename(file_name)) if self.ftp_enabled else None
+        try:
+            with self.metrics.timer('download', category=category) as stats:
+                size = stats['size'] = self.download_file(session, file_url, file_name, size=file_size, md5=json['obj'].get('md5'), stream=stream)
+        except BaseException:
+            if stream:
+                stream.abort()
+            raise
+
+        self.logger.info('File \'{}\' was succesfully downloaded and saved as \'{}\' ({} bytes were written)!'.format(file_remote_name, file_name, size))
+
+        if stream:
+            try:
+                result = stream.close()
+            except MIIIX_Error as err:
+                self.metrics.record('upload', time.time() - upload_started, stream.size, status='error', category=category)
+                self.logger.warning('{}. Uploading the downloaded file...'.format(err))
+                self.ftp_upload(file_name, category=category)
+            else:
+                # Mostly overlaps the download
+                self.metrics.record('upload', time.time() - upload_started, stream.size, category=category)
+                self.logger.info('FTP: File \'{}\' uploaded successfully! {}'.format(stream.name, result))
+            self.mark_uploaded(file_name)
+
+        return file_name
+
+
+    def is_uploaded(self, file_name):
+        return os.path.exists(file_name + '.uploaded')
 
-            self.logger.info('File \'{}\' was succesfully downloaded and saved as \'{}\' ({} bytes were written)!'.format(file_remote_name, file_name, len(response.content)))
 
-            # Upload files to FTP-server. Won't be run if enabled=False
-            self.ftp_upload(file_name, enabled=False)
+    def mark_uploaded(self, file_name):
+        # An empty marker next to the file, checked when the downloaded file is skipped by the next runs
+        open(file_name + '.uploaded', 'w').close()
 
+
+    def download_file(self, session, url, file_name, size=None, md5=None, stream=None):
+        '''
+        Streams the file in CHUNK_SIZE chunks to `file_name + '.part'` and renames it to `file_name` once it's complete.
+        Interrupted downloads are resumed from the .part file with Range requests (by the next run too).
+        The size is checked against `size` or the one reported by the server, the MD5 checksum against `md5`, if given.
+        All the chunks are also written to `stream`, if given (e.g. an FTPStream).
+        '''
+        part_file = file_name + '.part'
+        checksum = hashlib.md5()
+        offset = 0
+        if os.path.exists(part_file):
+            with open(part_file, 'rb') as f:
+                for chunk in iter(lambda: f.read(self.CHUNK_SIZE), b''):
+                    checksum.update(chunk)
+                    offset += len(chunk)
+                    if stream:
+                        stream.write(chunk)
+            self.logger.info('Resuming download of \'{}\' from {} bytes...'.format(url, offset))
+
+        total = int(size) if size is not None else None
+        for attempt in range(1, self.DOWNLOAD_RETRIES + 1):
+            if total is not None and offset >= total:
+                break
+
+            headers = dict(self.HEADERS, Range='bytes={}-'.format(offset)) if offset else self.HEADERS
+            response = None
+            try:
+                with self.send_request(session.get, url, headers=headers, stream=True, timeout=self.timeout) as response:
+                    # Nothing left to download
+                    if offset and response.status_code == 416:
+                        break
+                    if not response.ok:
+                        raise MIIIX_Error('File download failed. Status code: {}'.format(response.status_code))
+
+                    if offset and response.status_code != 206:
+                        self.logger.info('The server doesn\'t support resuming. Downloading \'{}\' from the start...'.format(url))
+                        offset, checksum = 0, hashlib.md5()
+                        if stream:
+                            # The streamed file can't be restarted: it'll be uploaded when downloaded
+                            stream.abort()
+
+                    if total is None:
+                        content_range = response.headers.get('Content-Range', '')
+                        content_length = response.headers.get('Content-Length')
+                        if '/' in content_range and not content_range.endswith('*'):
+                            total = int(content_range.rsplit('/', 1)[1])
+                        elif content_length is not None and response.status_code == 200:
+                            total = int(content_length)
+
+                    with open(part_file, 'ab' if offset else 'wb') as f:
+                        for chunk in response.iter_content(chunk_size=self.CHUNK_SIZE):
+                            f.write(chunk)
+                            checksum.update(chunk)
+                            offset += len(chunk)
+                            if stream:
+                                stream.write(chunk)
+            except (MIIIX_Error, requests.RequestException) as err:
+                # Only connection and server errors are worth retrying
+                if attempt == self.DOWNLOAD_RETRIES or (response is not None and 400 <= response.status_code < 500):
+                    raise MIIIX_Error('File download failed after {} attempts: {}'.format(attempt, err)) from err
+                self.logger.warning('Download of \'{}\' interrupted at {} bytes: {}. Retrying...'.format(url, offset, err))
+                continue
+
+            if total is None or offset >= total:
+                break
         else:
-            self.die('File download failed. Status code: {}'.format(response.status_code))
+            raise MIIIX_Error('File download failed: got {} bytes of {} after {} attempts'.format(offset, total, self.DOWNLOAD_RETRIES))
+
+        if (total is not None and offset != total) or (md5 and checksum.hexdigest() != md5.lower()):
+            os.remove(part_file)
+            raise MIIIX_Error('Downloaded file \'{}\' is corrupted: {} bytes of {}, MD5 {} instead of {}'.format(url, offset, total, checksum.hexdigest(), md5))
 
+        os.replace(part_file, file_name)
 
-    def set_export_payload(self, storage_category):
+        return offset
+
+
+    def set_export_payload(self, storage_category, storage_department=1):
         '''
         @storage_category - sets the storage_category_id variable
+        @storage_department - sets the storage_department_id variable
 
         Valid options are:
             1: tyres
@@ -201,57 +869,74 @@ class MIIIX_Parser():
             return {
                 'format': 'xls',
                 'storage_category_id': storage_category,
-                'storage_department_id': 1,
+                'storage_department_id': storage_department,
                 'filter[best_price][usage]': 0,
                 'filter[qty][value]': 4,
                 'filter[delta][value]': 2,
             }
         else:
-            self.die(
+            raise MIIIX_Error(
                 'storage_department_id can be whether 1 for tyres or 2 for rims. ' + \
                 'The value you provided \'{}\' is wrong! Exiting...'.format(storage_category)
             )
 
 
     def send_request(self, req, *args, **kwargs):
-        req_type = (req.__name__.upper() + " ") if req.__name__.upper() in ['GET', 'POST'] else ''
-
-        message = 'Sending {}request...'.format(req_type)
-        if args:
-            args_msg = ' Args: ' + ', '.join(map(str, args)) + '.'
-            message += args_msg
-        if kwargs:
-            kwargs_msg = ' Keyword args [\'data\']: '
-            if ('disable_log' in kwargs) and kwargs['disable_log']:
-                kwargs_msg += "<DISABLED>"
-            else:
-                kwargs_msg += "{}".format(kwargs['data'])
-
-            # Clear out kwargs for futher processing by requests
-            kwargs.pop('disable_log', None)
-            message += kwargs_msg
-
-        self.logger.info(message)
+        method = req.__name__.upper()
+        req_type = (method + " ") if method in ['GET', 'POST'] else ''
+        # Clear out kwargs for futher processing by requests
+        disable_log = kwargs.pop('disable_log', False)
+
+        # Payload dumps are formatted only if they are going to be logged
+        if self.logger.isEnabledFor(logging.INFO):
+            message = 'Sending {}request...'.format(req_type)
+            if args:
+                args_msg = ' Args: ' + ', '.join(map(str, args)) + '.'
+                message += args_msg
+            # Other keyword args (e.g. timeout, stream) are set on every request and not worth logging
+            if 'data' in kwargs:
+                kwargs_msg = ' Keyword args [\'data\']: '
+                if disable_log:
+                    kwargs_msg += "<DISABLED>"
+                else:
+                    kwargs_msg += "{}".format(kwargs['data'])
+                message += kwargs_msg
+
+            self.logger.info(message)
+
+        started = time.time()
         try:
             response = req(*args, **kwargs)
         except Exception as err:
-            self.die(err)
+            self.metrics.observe('request_duration_seconds', time.time() - started, method=method)
+            self.metrics.inc('requests_total', method=method, status='error')
+            raise MIIIX_Error(err) from err
         else:
+            # Streamed responses are timed until their headers are received
+            self.metrics.observe('request_duration_seconds', time.time() - started, method=method)
+            self.metrics.inc('requests_total', method=method, status=response.status_code)
             self.logger.info('Success! Got response.')
             return response
 
 
-    def ftp_upload(self, file, enabled=True):
-        if enabled:
-            ftp = FTP(**self.ftp_settings)
-            ftp.cwd(self.ftp_settings_upload_dir)
+    def get_ftp_uploader(self):
+        with self.ftp_lock:
+            if self.ftp_uploader is None:
+                self.ftp_uploader = FTPUploader(upload_dir=self.ftp_settings_upload_dir, block_size=self.ftp_block_size, **self.ftp_settings)
 
-            with open(file, 'rb') as f:
-                result = ftp.storbinary('STOR {}'.format(file.split('/')[-1]), f)
-                if result == '226 Transfer complete':
-                    self.logger.info('FTP: File uloaded successfully!')
+        return self.ftp_uploader
 
-            ftp.quit()
+
+    def ftp_upload(self, file, enabled=True, category=None):
+        if enabled:
+            try:
+                with self.metrics.timer('upload', category=category) as stats:
+                    stats['size'] = os.path.getsize(file)
+                    result = self.get_ftp_uploader().upload(file)
+            except ftp_errors as err:
+                raise MIIIX_Error('FTP upload of \'{}\' failed: {}'.format(file, err)) from err
+
+            self.logger.info('FTP: File \'{}\' uploaded successfully! {}'.format(os.path.basename(file), result))
 
 
     def init_logger(self, logfile, level, console_enabled=False):